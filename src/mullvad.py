@@ -1,42 +1,236 @@
 # python 3
 # encoding: utf-8
 
-import os
 import sys
-import subprocess
+import time
+import shlex
+import threading
 from datetime import datetime
+from collections import namedtuple
 
-from workflow import Workflow, MATCH_SUBSTRING
+from workflow import Workflow, MATCH_ATOM, MATCH_STARTSWITH, MATCH_SUBSTRING
 from workflow.background import run_in_background
 
 import mullvad_actions
+import mullvad_broker
+import mullvad_runner
+import mullvad_watcher
 import helpers
+import relays
 
 GITHUB_SLUG = 'atticusmatticus/alfred-mullvad'
+PROBE_TIMEOUT = 2 # render budget: seconds the start screen waits for its status probes before showing placeholders
+SERVER_RESULTS = 50 # most servers the server view lists, best matches first
+MUTATING_VERBS = ('set', 'connect', 'disconnect', 'reconnect', 'update') # commands that invalidate memoized output
+FAILURE_BUNDLE = 'mullvad_failures' # cache bundle of failed commands, keyed by command line
+FAILURE_BACKOFF = 2 # seconds a failed command is answered from FAILURE_BUNDLE before it is tried again, doubled per failure
+FAILURE_BACKOFF_MAX = 60
+
+wf = Workflow() #update_settings={'github_slug': GITHUB_SLUG}) # module level, so subroutines also work when imported by the helper scripts
+
+runner = mullvad_runner.Runner() # `mullvad` binary and environment, resolved once per process
+
+# results of commands already run in this invocation, keyed by argv tuple
+memo = {}
+memoStats = {'hits': 0, 'misses': 0}
+memoLock = threading.Lock()
 
 #############################
 ######## SUBROUTINES ########
 #############################
 
+class CommandResult(namedtuple('CommandResult', ['returncode', 'stdout', 'stderr', 'duration'])):
+    """ Outcome of a terminal command: exit code, stdout and stderr text and seconds it took """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+class CommandError(Exception):
+    """ Raised by execute_checked() and execute_lines() for a failed command """
+
+    def __init__(self, cmdList, result):
+        Exception.__init__(self, '{} failed with exit code {}: {}'.format(
+            ' '.join(cmdList), result.returncode, result.stderr.strip()))
+        self.cmdList = cmdList
+        self.result = result
+
+
 def execute(cmdList):
-    """ Execute a terminal command from list of arguments
+    """ Execute a terminal command from list of arguments, at most once per invocation.
+    Read-only commands are answered from the memo, then the broker if it is running.
+    Mutating commands always run and clear the memo.
+    Read-only commands that failed recently are not run again until their backoff has passed,
+    their recorded failure is returned instead.
 
     Arguments:
     cmdList -- command line command (list of strings)
 
     Returns:
-    cmd/err -- output of terminal command (tuple of strings)
+    CommandResult of the command
+    """
+    if mutating(cmdList[1:]):
+        with memoLock:
+            memo.clear()
+        result = execute_direct(cmdList)
+        mullvad_broker.invalidate()
+        return result
+    return execute_many([cmdList])[0]
+
+
+def mutating(args):
+    """ Whether a command changes mullvad's state
+    Arguments:
+    args -- arguments of the command (list of strings)
+    Returns:
+    Boolean
     """
-    newEnv = os.environ.copy()
-    newEnv['PATH'] = '/usr/local/bin:%s' % newEnv['PATH'] # prepend the path to `mullvad` executable to the system path
-    cmd, err = subprocess.Popen(cmdList,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                text=True, # output from commands is type `str` instead of `byte`
-                                env=newEnv).communicate() # .communicate() returns cmd and err as a tuple
-    if err:
-        return err
-    return cmd
+    return any(verb in MUTATING_VERBS for verb in args)
+
+
+def execute_many(cmdLists, budget=None):
+    """ execute() several read-only commands, running the ones not answered otherwise concurrently
+
+    Arguments:
+    cmdLists -- list of command line commands
+    budget -- seconds after which commands still running are cancelled, None to wait for all of them
+
+    Returns:
+    List of CommandResults in the order of cmdLists, None for commands cancelled by the budget.
+    Later calls in this invocation get a failed result for those instead of waiting on them again.
+    """
+    results = {}
+    pending = []
+    for cmdList in cmdLists:
+        key = tuple(cmdList)
+        with memoLock:
+            if key in memo:
+                memoStats['hits'] += 1
+                results[key] = memo[key]
+                continue
+            memoStats['misses'] += 1
+        result = recent_failure(cmdList)
+        if result is None:
+            pending.append(cmdList)
+            continue
+        with memoLock:
+            memo[key] = results[key] = result
+    # the broker is asked for each command concurrently, within the same budget as the commands it does not answer
+    replies = runner.run_many(pending, budget=budget, ask=mullvad_broker.ask) if pending else []
+    for cmdList, reply in zip(pending, replies):
+        if reply is None: # cancelled: not a failure of the command, so no backoff
+            with memoLock:
+                memo[tuple(cmdList)] = CommandResult(mullvad_runner.TIMEOUT_EXIT, '',
+                                                     'cancelled after {}s'.format(budget), budget)
+            continue
+        result = CommandResult(*reply)
+        record_result(cmdList, result)
+        with memoLock:
+            memo[tuple(cmdList)] = results[tuple(cmdList)] = result
+    return [results.get(tuple(cmdList)) for cmdList in cmdLists]
+
+
+def execute_checked(cmdList):
+    """ execute() a command that has to succeed
+
+    Arguments:
+    cmdList -- command line command (list of strings)
+
+    Returns:
+    String of the command's stdout
+
+    Raises:
+    CommandError if the command failed
+    """
+    result = execute(cmdList)
+    if not result.ok:
+        raise CommandError(cmdList, result)
+    return result.stdout
+
+
+def execute_direct(cmdList):
+    """ Execute a terminal command from list of arguments by forking it
+
+    Arguments:
+    cmdList -- command line command (list of strings)
+
+    Returns:
+    CommandResult of the command, killed after mullvad_runner.COMMAND_TIMEOUT seconds
+    """
+    return CommandResult(*runner.run(cmdList))
+
+
+def execute_lines(cmdList):
+    """ Execute a terminal command and yield its output while it is still running
+
+    Arguments:
+    cmdList -- command line command (list of strings)
+
+    Yields:
+    Lines of stdout without their line endings
+
+    Raises:
+    CommandError once the output is consumed if the command failed or was killed after
+    mullvad_runner.COMMAND_TIMEOUT seconds, or right away while it is backing off
+    """
+    result = recent_failure(cmdList)
+    if result is not None:
+        raise CommandError(cmdList, result)
+    start = time.time()
+    returncode, stderr = yield from runner.lines(cmdList)
+    result = CommandResult(returncode, '', stderr, time.time() - start)
+    record_result(cmdList, result)
+    if not result.ok:
+        raise CommandError(cmdList, result)
+
+
+def recent_failure(cmdList):
+    """ Recorded failure of a command that is still backing off
+    Arguments:
+    cmdList -- command line command (list of strings)
+    Returns:
+    CommandResult of the last failed run, or None if the command may run
+    """
+    failure = wf.cache_bundle(FAILURE_BUNDLE).get(' '.join(cmdList), max_age=0)
+    if failure is None or time.time() >= failure['retry']:
+        return None
+    return CommandResult(failure['returncode'], '', failure['stderr'], 0.0)
+
+
+def record_result(cmdList, result):
+    """ Record a failed command with exponential backoff, or forget its failures once it succeeds
+    Arguments:
+    cmdList -- command line command (list of strings)
+    result -- CommandResult of the command
+    """
+    failures = wf.cache_bundle(FAILURE_BUNDLE)
+    key = ' '.join(cmdList)
+    failure = failures.get(key, max_age=0)
+    if result.ok:
+        if failure is not None:
+            failures.set(key, None)
+        return
+    count = failure['count'] + 1 if failure else 1
+    backoff = min(FAILURE_BACKOFF * 2 ** (count - 1), FAILURE_BACKOFF_MAX)
+    failures.set(key, {'count': count, 'retry': time.time() + backoff,
+                       'returncode': result.returncode, 'stderr': result.stderr})
+    wf.logger.warning('%s failed %d times, retrying in %ds: %s', key, count, backoff, result.stderr.strip())
+
+
+def cli_arg(args):
+    """ Shell command running the `mullvad` CLI, for the arg of an item
+    Arguments:
+    args -- arguments of the command (string)
+    Returns:
+    String of the command line, starting with the resolved path of the CLI.
+    Commands changing mullvad's state are followed by a `touch` of the broker's change marker.
+    """
+    command = '{} {}'.format(shlex.quote(runner.binary), args)
+    if mutating(args.split()):
+        command += '; touch {}'.format(shlex.quote(mullvad_broker.BROKER_CHANGED))
+    return command
 
 
 def get_auto_connect():
@@ -48,7 +242,7 @@ def get_auto_connect():
     Returns:
     String of status -- "Autoconnect: on/off"
     """
-    return execute(['mullvad', 'auto-connect', 'get']).splitlines()
+    return execute_checked(['mullvad', 'auto-connect', 'get']).splitlines()
 
 
 def get_lan():
@@ -60,7 +254,7 @@ def get_lan():
     Returns:
     String of status -- "Local network sharing setting: allow/block"
     """
-    return execute(['mullvad', 'lan', 'get']).splitlines()
+    return execute_checked(['mullvad', 'lan', 'get']).splitlines()
 
 
 def get_kill_switch():
@@ -72,7 +266,7 @@ def get_kill_switch():
     Returns:
     String of status -- "Network traffic will be allowed/blocked when the VPN is disconnected"
     """
-    return execute(['mullvad', 'always-require-vpn', 'get']).splitlines()
+    return execute_checked(['mullvad', 'always-require-vpn', 'get']).splitlines()
 
 
 def get_version():
@@ -84,7 +278,7 @@ def get_version():
     Returns:
     List -- [mullvad supported:True/False, currentVersion='1234.5', latestVersion='6789.0']
     """
-    mullVersion = execute(['mullvad', 'version'])
+    mullVersion = execute_checked(['mullvad', 'version'])
     # print mullVersion
     supported = mullVersion.splitlines()[1].split()[2]
     if supported == 'true':
@@ -100,75 +294,80 @@ def get_version():
     return [supported, currentVersion, latestVersion]
 
 
-def connection_status():
+def connection_status(connection=None, protocol=None):
     """ Add workflow item of current connection status
     Arguments:
-    None
+    connection -- output of get_connection(), fetched if None
+    protocol -- output of get_protocol(), fetched if None
     Returns:
     Item -- Connected/Disconnected/Blocked
     """
-    for status in get_connection():
+    if connection is None:
+        connection = get_connection()
+    for status in connection:
         # print('DEBUG:', 'status:', status)
         stat = str(status.split()[0])
         # print('DEBUG:', 'stat:', stat)
         if stat == 'Connected':
-            countryString, cityString = get_country_city()
+            try:
+                countryString, cityString = get_country_city(protocol)
+                location = '{} {}'.format(cityString, countryString)
+            except CommandError: # relay constraints unknown, fall back to the location in the status sentence
+                location = ' '.join(status.split()[4:])
             # print('DEBUG:', '{} to: {} {}'.format(stat, cityString, countryString))#.decode('utf8'))
             # print('DEBUG:', ' '.join(status.split()[4:])+'. Select to Disconnect.')
-            wf.add_item('{} to: {} {}'.format(stat, cityString, countryString), #.decode('utf8'),
+            wf.add_item('{} to: {}'.format(stat, location), #.decode('utf8'),
                         subtitle=' '.join(status.split()[4:])+'. Select to Disconnect. Type "relay" to change.',
-                        arg='/usr/local/bin/mullvad disconnect',
+                        arg=cli_arg('disconnect'),
                         valid=True,
                         icon='icons/mullvad_green.png')
         elif stat == 'Disconnected':
             wf.add_item(stat,
                         subtitle='Select to Connect',
-                        arg='/usr/local/bin/mullvad connect',
+                        arg=cli_arg('connect'),
                         valid=True,
                         icon='icons/mullvad_red.png')
         elif stat == 'Blocked:':
             wf.add_item(stat[:-1],
                         subtitle='This device is offline, no tunnels can be established...',
-                        arg='/usr/local/bin/mullvad reconnect',
+                        arg=cli_arg('reconnect'),
                         valid=True,
                         icon='icons/mullvad_red.png')
 
 
-def get_country_city():
+def get_country_city(getProt=None):
     """ Get the current country and city relay information
+    :param getProt: output of get_protocol(), fetched if None
     :returns countryString: 
     """
     # TODO: make this work for OpenVPN as well as Wireguard
-    getProt = get_protocol()
+    if getProt is None:
+        getProt = get_protocol()
     # print 'getProt: {}'.format(getProt)
     sep = getProt.index(',')
     # print 'sep: {}'.format(sep)
-    countryCodeSearch = '({})'.format(getProt[sep+2:sep+4])
-    # print 'DEBUG: countryCodeSearch', countryCodeSearch #debug
-    cityCodeSearch = '({})'.format(getProt[sep-3:sep])
-    # cityCodeSearch = '({})'.format(get_protocol()[8][0:3])
-    # print 'DEBUG: cityCodeSearch', cityCodeSearch
-    countries = wf.cached_data('mullvad_country_list',
-                               get_country_list,
-                               max_age=432000)
-    # print 'DEBUG: countries', countries #debug
-    index = [i for i,s in enumerate(countries) if countryCodeSearch in s][0]
-    relayList = wf.cached_data('mullvad_relay_list',
-                               get_relay_list,
-                               max_age=432000)
-    countryString = countries[index].split()[:-1][0]
-    # print countryString #debug
-    cityString = ' '.join([city[0] for city in relayList[index][1:] if cityCodeSearch in city[0]][0].split()[:-1])
-    # print cityString #debug
+    countryCode = getProt[sep+2:sep+4]
+    cityCode = getProt[sep-3:sep]
+    relayIndex = wf.cached_data('mullvad_relay_index',
+                                get_relay_list,
+                                max_age=432000,
+                                serializer=relays.SERIALIZER)
+    country = relayIndex.country(countryCode)
+    city = relayIndex.city(countryCode, cityCode)
+    countryString = country.name if country else countryCode
+    cityString = city.name if city else cityCode
     return countryString, cityString
 
 
 def get_connection():
-    """ VPN connection tunnel status
+    """ VPN connection tunnel status, from the watcher's cache if it is running, else by polling `mullvad status`
     :returns: sentence of tunnel status
     :type returns: tuple of a single sentence string
     """
-    return execute(['mullvad', 'status']).splitlines()
+    watched = mullvad_watcher.watched_status(wf)
+    if watched is not None:
+        return watched
+    return execute_checked(['mullvad', 'status']).splitlines()
 
 
 def check_connection():
@@ -179,25 +378,59 @@ def check_connection():
                 icon='icons/mullvad_yellow.png')
 
 
-def set_kill_switch():
-    for status in get_kill_switch():
+def pending_status(title, autocomplete):
+    """ Add placeholder item for a status `mullvad` did not report within PROBE_TIMEOUT
+    Arguments:
+    title -- name of the status
+    autocomplete -- query of the view showing the status on its own
+    """
+    wf.add_item('{}: ...'.format(title),
+                subtitle='No answer from mullvad yet. Select to check again',
+                autocomplete=autocomplete,
+                valid=False,
+                icon='icons/chevron-right-dark.png')
+
+
+def daemon_unreachable(cmdList):
+    """ Add workflow item for a failed `mullvad` command, from its recorded failure
+    Arguments:
+    cmdList -- command line command (list of strings)
+    """
+    failure = wf.cache_bundle(FAILURE_BUNDLE).get(' '.join(cmdList), max_age=0)
+    if failure is None: # the command did not answer in time
+        subtitle = '`{}` did not answer'.format(' '.join(cmdList))
+    else:
+        reason = failure['stderr'].strip().splitlines() or ['exit code {}'.format(failure['returncode'])]
+        subtitle = '{} Retrying in {}s.'.format(reason[0], max(0, int(failure['retry'] - time.time())))
+    wf.add_item('Mullvad daemon unreachable',
+                subtitle=subtitle,
+                valid=False,
+                icon='icons/mullvad_red.png')
+
+
+def set_kill_switch(statuses=None):
+    if statuses is None:
+        statuses = get_kill_switch()
+    for status in statuses:
         if status == 'Network traffic will be blocked when the VPN is disconnected':
             killStat = ['Enabled', 'off', 'green']
         elif status == 'Network traffic will be allowed when the VPN is disconnected':
             killStat = ['Disabled', 'on', 'red']
         wf.add_item('Always Require VPN: ' + killStat[0],
                     subtitle=status + '. Select to switch',
-                    arg='/usr/local/bin/mullvad always-require-vpn set {}'.format(killStat[1]),
+                    arg=cli_arg('always-require-vpn set {}'.format(killStat[1])),
                     valid=True,
                     icon='icons/skull_{}.png'.format(killStat[2]))
 
 
 def get_protocol():
-    return execute(['mullvad','relay','get'])
+    return execute_checked(['mullvad','relay','get'])
 
 
-def protocol_status():
-    status = get_protocol().split(':')[1].split()[0]
+def protocol_status(protocol=None):
+    if protocol is None:
+        protocol = get_protocol()
+    status = protocol.split(':')[1].split()[0]
     wf.add_item('Protocol: {}'.format(status),
                 subtitle='Change protocol',
                 autocomplete='protocol',
@@ -209,7 +442,7 @@ def set_protocol(query):
     for formula in filter_tunnel_protocols(query):
         wf.add_item(formula,
                     subtitle='Change protocol to {}'.format(formula),
-                    arg='/usr/local/bin/mullvad relay set tunnel-protocol {}'.format(formula.lower()),
+                    arg=cli_arg('relay set tunnel-protocol {}'.format(formula.lower())),
                     valid=True,
                     icon='icons/{}.png'.format(formula.lower()))
 
@@ -222,24 +455,28 @@ def filter_tunnel_protocols(query):
     return protocols
 
 
-def set_auto_connect():
-    for status in get_auto_connect():
+def set_auto_connect(statuses=None):
+    if statuses is None:
+        statuses = get_auto_connect()
+    for status in statuses:
         wf.add_item(status,
                     'Current auto-connect status.',
-                    arg='/usr/local/bin/mullvad auto-connect get',
+                    arg=cli_arg('auto-connect get'),
                     valid=True,
                     icon='icons/chevron-right-dark.png')
 
 
-def set_lan():
-    for status in get_lan():
+def set_lan(statuses=None):
+    if statuses is None:
+        statuses = get_lan()
+    for status in statuses:
         if status == 'Local network sharing setting: allow':
             lanStat = ['Allowed', 'block', 'green']
         elif status == 'Local network sharing setting: block':
             lanStat = ['Blocked', 'allow', 'red']
         wf.add_item('LAN: {}'.format(lanStat[0]),
                     subtitle=status + '. Select to switch',
-                    arg='/usr/local/bin/mullvad lan set {}'.format(lanStat[1]),
+                    arg=cli_arg('lan set {}'.format(lanStat[1])),
                     valid=True,
                     icon='icons/lan_{}.png'.format(lanStat[2]))
 
@@ -248,7 +485,7 @@ def set_reconnect():
     for status in get_connection():
         wf.add_item('Reconnect',
                     subtitle=status,
-                    arg='/usr/local/bin/mullvad reconnect',
+                    arg=cli_arg('reconnect'),
                     valid=True,
                     icon='icons/chevron-right-dark.png') #TODO recycle loop arrow orange/yellow
 
@@ -261,9 +498,11 @@ def unsupported_mullvad():
                 icon='icons/chevron-right-dark.png') #TODO orange/yellow '?' icon
 
 
-def update_mullvad():
+def update_mullvad(version=None):
     # TODO: Download with something that ships with macOS rather than brewed `wget` in /usr/local/bin/
-    latestVersion = wf.cached_data('mullvad_version', data_func=get_version, max_age=86400)[2]
+    if version is None:
+        version = cached_version()
+    latestVersion = version[2]
     # print(latestVersion)
     wf.add_item('Update mullvad',
                 subtitle='The currently installed version of Mullvad is out-of-date',
@@ -272,18 +511,29 @@ def update_mullvad():
                 icon='icons/cloud-download-dark.png')
 
 
+def cached_version():
+    """ get_version() from the start screen cache bundle, refreshed in the background once a day old """
+    return wf.cache_bundle('mullvad_start').get('version', get_version, max_age=86400,
+                                                stale_while_revalidate=True)
+
+
+def cached_account():
+    """ get_account() from the start screen cache bundle, refreshed in the background once a day old """
+    return wf.cache_bundle('mullvad_start').get('account', get_account, max_age=86400,
+                                                stale_while_revalidate=True)
+
+
 def get_account():
-    getAcct = execute(['mullvad', 'account', 'get']).splitlines()
+    getAcct = execute_checked(['mullvad', 'account', 'get']).splitlines()
     # print('DEBUG:', getAcct[2].split()[3])
     # print('DEBUG:', type(getAcct[2].split()[3]), type('%Y-%m-%d'))
     deltaDays = (datetime.strptime(getAcct[2].split()[3], '%Y-%m-%d') - datetime.utcnow()).days
     return [getAcct[0].split()[2], deltaDays]
 
 
-def add_time_account():
-    formulas = wf.cached_data('mullvad_account',
-                              get_account,
-                              max_age=86400)
+def add_time_account(formulas=None):
+    if formulas is None:
+        formulas = cached_account()
     wf.add_item('Account #: {} expires in: {} days'.format(formulas[0], formulas[1]),
                 subtitle='Open mullvad account website and copy account number to clipboard',
                 arg='echo {} | pbcopy && open https://mullvad.net/en/account/'.format(formulas[0]), # copy account number to clipboard and open mullvad account login screen
@@ -292,6 +542,58 @@ def add_time_account():
     #TODO delete cache
 
 
+def start_watcher():
+    """ Launch the status watcher in the background, unless one of its commands failed recently.
+    A watcher would only fail again, and forks a Python process and `mullvad` on every keystroke.
+    Returns:
+    Boolean, whether the watcher was launched (or is already running)
+    """
+    for cmdList in (mullvad_watcher.STATUS_COMMAND, mullvad_watcher.LISTEN_COMMAND):
+        if recent_failure(cmdList) is not None:
+            return False
+    cmd = ['/usr/bin/python3', wf.workflowfile('mullvad_watcher.py')]
+    run_in_background(mullvad_watcher.WATCHER_NAME, cmd)
+    return True
+
+
+def probe_status():
+    """ Run the start screen's CLI calls concurrently, cancelling the ones still running after PROBE_TIMEOUT
+    Arguments:
+    None
+    Returns:
+    Tuple of (dictionary of probe name -> result, None for probes that failed or were cancelled,
+    list of names of the cancelled probes)
+    """
+    probes = {
+        'connection': (['mullvad', 'status'], get_connection),
+        'kill_switch': (['mullvad', 'always-require-vpn', 'get'], get_kill_switch),
+        'protocol': (['mullvad', 'relay', 'get'], get_protocol),
+        'lan': (['mullvad', 'lan', 'get'], get_lan),
+        'auto_connect': (['mullvad', 'auto-connect', 'get'], get_auto_connect),
+        'version': (['mullvad', 'version'], cached_version),
+        'account': (['mullvad', 'account', 'get'], cached_account),
+    }
+    startBundle = wf.cache_bundle('mullvad_start')
+    known = set(startBundle.entries) # version and account only run once their cache entry is missing
+    if mullvad_watcher.watched_status(wf) is not None:
+        known.add('connection') # get_connection() reads the watcher's cache
+    needed = [cmdList for name, (cmdList, _) in probes.items() if name not in known]
+    fetched = dict(zip(map(tuple, needed), execute_many(needed, budget=PROBE_TIMEOUT))) # results land in the memo, so the parsers below don't run anything
+    results = {}
+    cancelled = []
+    for name, (cmdList, probe) in probes.items():
+        results[name] = None
+        if tuple(cmdList) in fetched and fetched[tuple(cmdList)] is None:
+            wf.logger.warning('probe %s cancelled after %ss', name, PROBE_TIMEOUT)
+            cancelled.append(name)
+            continue
+        try:
+            results[name] = probe()
+        except Exception as err:
+            wf.logger.warning('probe %s failed: %r', name, err)
+    return results, cancelled
+
+
 def update_relay_list():
     # TODO add this to its own subroutine that gets run in the background
     execute(['mullvad', 'relay', 'update'])
@@ -322,40 +624,47 @@ def filter_relay_countries(wf, query):
     # print query
     countries = wf.cached_data('mullvad_country_list',
                                get_country_list,
-                               max_age=432000)
+                               max_age=432000,
+                               serializer=relays.LISTS_SERIALIZER)
     # print query
     queryFilter = query.split()
     # print query, queryFilter
     if len(queryFilter) > 1:
-        return wf.filter(queryFilter[1], countries, match_on=MATCH_SUBSTRING)
+        keys = search_keys(wf, 'mullvad_search_countries', countries)
+        return wf.filter(queryFilter[1], countries, keys=keys, match_on=MATCH_SUBSTRING)
     return countries
 
 
+def search_keys(wf, name, items, countryCode=None):
+    """ Precomputed filter keys written by the refresh job
+    Arguments:
+    name -- cache name of the keys
+    items -- list of strings the keys must belong to
+    countryCode -- pick the keys of one country from a per-country cache
+    Returns:
+    List of workflow SearchKeys, or None if the keys are missing or were built for a different relay list
+    """
+    keys = wf.cached_data(name, max_age=0)
+    if keys is not None and countryCode is not None:
+        keys = keys.get(countryCode)
+    if keys is None or [key.value for key in keys] != items:
+        return None
+    return keys
+
+
 def get_country_list():
-    countries = []
-    formulas = wf.cached_data('mullvad_relay_list',
-                              get_relay_list,
-                              max_age=432000)
-    for formula in formulas:
-        countries.append(formula[0]) #.decode('utf8'))
-    return countries
+    relayIndex = wf.cached_data('mullvad_relay_index',
+                                get_relay_list,
+                                max_age=432000,
+                                serializer=relays.SERIALIZER)
+    return relayIndex.labels()
 
 
 def get_relay_list():
-    i = -1
-    relayList = []
-    for line in execute(['mullvad', 'relay', 'list']).splitlines():
-        if line.strip(): # if the line is not empty
-            if line[0] != '\t': # country
-                i += 1
-                j = 0
-                relayList.append([line])
-            elif line[0] == '\t' and line[1] != '\t': # city
-                j += 1
-                relayList[i].append([line.split("@")[0].strip()])
-            elif line[:2] == '\t\t': # server
-                relayList[i][j].append(line.split())
-    return relayList
+    """ Parse `mullvad relay list` into a relays.RelayIndex of countries, cities and servers.
+    The CLI output is parsed as it is read instead of being buffered first.
+    """
+    return relays.parse_relay_list(execute_lines(['mullvad', 'relay', 'list']))
 
 
 def list_relay_cities(wf, query):
@@ -370,33 +679,81 @@ def list_relay_cities(wf, query):
         cityCode = city.split('(')[1].split(')')[0]
         wf.add_item(city,
                     subtitle='Connect to servers in this city',
-                    arg='/usr/local/bin/mullvad relay set location {} {}'.format(countryCode,cityCode),
+                    arg=cli_arg('relay set location {} {}'.format(countryCode,cityCode)),
                     valid=True,
                     icon='icons/chevron-right-dark.png') #TODO maybe add red locks for servers that arent being currently used and green lock for the server that is connected to currently
 
 
 def get_city_list(wf, countryCode):
-    relayList = wf.cached_data('mullvad_relay_list',
-                               get_relay_list,
-                               max_age=432000)
-    countries = wf.cached_data('mullvad_country_list',
-                               get_country_list,
-                               max_age=432000)
-    countryCodeSearch = '({})'.format(countryCode)
-    index = [i for i, s in enumerate(countries) if countryCodeSearch in s][0]
-    cities = []
-    for city in relayList[index][1:]:
-        cities.append(city[0]) #.decode('utf8'))
-    wf.cache_data('mullvad_cities_list', cities)
+    """ City labels of one country, from the per-country city cache written alongside the relay list """
+    cityLists = wf.cached_data('mullvad_city_lists',
+                               get_city_lists,
+                               max_age=432000,
+                               serializer=relays.LISTS_SERIALIZER)
+    return cityLists.get(countryCode, [])
+
+
+def get_city_lists():
+    relayIndex = wf.cached_data('mullvad_relay_index',
+                                get_relay_list,
+                                max_age=432000,
+                                serializer=relays.SERIALIZER)
+    return relays.city_lists(relayIndex)
+
+
+def list_relay_servers(wf, query):
+    """ List servers matching a hostname, IP or protocol fragment, best matches first
+    Argument:
+    query -- server `fragment`
+    Returns:
+    List of Items of servers, or a prompt for the fragment
+    """
+    if len(query.split()) < 2: # thousands of servers, don't list them all
+        wf.add_item('Type a hostname, IP or protocol',
+                    subtitle='e.g. se-mma, 193.138 or wireguard',
+                    autocomplete='server ',
+                    valid=False,
+                    icon='icons/chevron-right-dark.png')
+        return
+    for server in filter_relay_servers(wf, query):
+        searchText, hostname, countryCode, cityCode, cityName, countryName, protocol, addresses = server
+        wf.add_item(hostname,
+                    subtitle='{}, {} - {} {}'.format(cityName, countryName, protocol, addresses),
+                    arg=cli_arg('relay set location {} {} {}'.format(countryCode, cityCode, hostname)),
+                    valid=True,
+                    icon='icons/{}.png'.format(protocol.lower()) if protocol.lower() in ['wireguard', 'openvpn'] else 'icons/chevron-right-dark.png')
+
+
+def get_server_list():
+    relayIndex = wf.cached_data('mullvad_relay_index',
+                                get_relay_list,
+                                max_age=432000,
+                                serializer=relays.SERIALIZER)
+    return relays.server_list(relayIndex)
+
+
+def filter_relay_servers(wf, query):
+    servers = wf.cached_data('mullvad_server_list',
+                             get_server_list,
+                             max_age=432000,
+                             serializer=relays.LISTS_SERIALIZER)
+    queryFilter = query.split()
+    if len(queryFilter) > 1:
+        keys = search_keys(wf, 'mullvad_search_servers', [server[0] for server in servers])
+        return wf.filter(' '.join(queryFilter[1:]), servers,
+                         key=lambda server: server[0],
+                         keys=keys,
+                         max_results=SERVER_RESULTS,
+                         match_on=MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING)
+    return servers[:SERVER_RESULTS]
 
 
 def filter_relay_cities(wf, countryCode, query):
-    cities = wf.cached_data('mullvad_cities_list',
-                            get_city_list(wf, countryCode),
-                            max_age=1)
+    cities = get_city_list(wf, countryCode)
     queryFilter = query.split()
     if len(queryFilter) > 1:
-        return wf.filter(queryFilter[1], cities, match_on=MATCH_SUBSTRING)
+        keys = search_keys(wf, 'mullvad_search_cities', cities, countryCode)
+        return wf.filter(queryFilter[1], cities, keys=keys, match_on=MATCH_SUBSTRING)
     return cities
 
 
@@ -416,26 +773,37 @@ def main(wf):
     query = wf.args[0] if len(wf.args) else None # if there's an argument(s) `query` is the first one. Otherwise it's `None`
 
     if not query: # starting screen of information.
-        if wf.cached_data('mullvad_version',
-                          get_version,
-                          max_age=86400)[1] != wf.cached_data('mullvad_version',
-                                                              get_version,
-                                                              max_age=86400)[2]:
-            update_mullvad()
-        if wf.cached_data('mullvad_version',
-                          get_version,
-                          max_age=86400)[0] == False:
+        probes, cancelled = probe_status() # every CLI call at once, so the screen waits for the slowest one only
+        version = probes['version']
+        if version and version[1] != version[2]:
+            update_mullvad(version)
+        if version and version[0] == False:
             unsupported_mullvad()
-        if wf.cached_data('mullvad_account',
-                          get_account,
-                          max_age = 86400)[1] <= 5:
-            add_time_account()
-        connection_status()
-        set_kill_switch()
-        protocol_status()
-        set_lan()
+        if probes['account'] and probes['account'][1] <= 5:
+            add_time_account(probes['account'])
+        if probes['connection'] is not None:
+            connection_status(probes['connection'], probes['protocol'])
+        elif 'connection' in cancelled:
+            pending_status('Connection', '')
+        else:
+            daemon_unreachable(['mullvad', 'status'])
+        if probes['kill_switch'] is not None:
+            set_kill_switch(probes['kill_switch'])
+        elif 'kill_switch' in cancelled:
+            pending_status('Always Require VPN', 'always-require-vpn')
+        if probes['protocol'] is not None:
+            protocol_status(probes['protocol'])
+        elif 'protocol' in cancelled:
+            pending_status('Protocol', 'tunnel')
+        if probes['lan'] is not None:
+            set_lan(probes['lan'])
+        elif 'lan' in cancelled:
+            pending_status('LAN', 'lan')
         check_connection()
-        set_auto_connect()
+        if probes['auto_connect'] is not None:
+            set_auto_connect(probes['auto_connect'])
+        elif 'auto_connect' in cancelled:
+            pending_status('Autoconnect', 'auto-connect')
         for action in mullvad_actions.ACTIONS:
             if action['name'] in ['relay', 'reconnect', 'account']:
                 wf.add_item(action['name'], action['description'],
@@ -445,57 +813,63 @@ def main(wf):
                             valid=action['valid'],
                             icon=action['icon'])
 
-    if query and query.startswith('check'):
-        check_connection()
-
-    elif query and any(query.startswith(x) for x in ['always-require-vpn', 'block-when-disconnected']):
-        set_kill_switch()
+    try:
+        if query and query.startswith('check'):
+            check_connection()
 
-    elif query and query.startswith('relay'):
-        list_relay_countries(wf, query)
+        elif query and any(query.startswith(x) for x in ['always-require-vpn', 'block-when-disconnected']):
+            set_kill_switch()
 
-    elif query and query.startswith('country:'):
-        list_relay_cities(wf, query)
+        elif query and query.startswith('relay'):
+            list_relay_countries(wf, query)
 
-    elif query and query.startswith('lan'):
-        set_lan()
+        elif query and query.startswith('country:'):
+            list_relay_cities(wf, query)
 
-    elif query and query.startswith('auto-connect'):
-        set_auto_connect()
+        elif query and query.startswith('server'):
+            list_relay_servers(wf, query)
 
-    elif query and query.startswith('reconnect'):
-        set_reconnect()
+        elif query and query.startswith('lan'):
+            set_lan()
 
-    elif query and query.startswith('protocol'):
-        set_protocol(query)
+        elif query and query.startswith('auto-connect'):
+            set_auto_connect()
 
-    elif query and query.startswith('account'):
-        add_time_account()
+        elif query and query.startswith('reconnect'):
+            set_reconnect()
 
-    elif query and any(query.startswith(x) for x in ['tunnel', 'protocol']):
-        protocol_status()
+        elif query and query.startswith('protocol'):
+            set_protocol(query)
 
-    elif query:
-        # TODO change from actions dictionary to a filter function
-        actions = mullvad_actions.ACTIONS
-        # filter actions by query
-        if query:
-            actions = wf.filter(query, actions,
-                                key=helpers.search_key_for_action,
-                                match_on=MATCH_SUBSTRING)
+        elif query and query.startswith('account'):
+            add_time_account()
 
-        if len(actions) > 0:
-            for action in actions:
-                wf.add_item(action['name'], action['description'],
-                            uid=action['name'],
-                            autocomplete=action['autocomplete'],
-                            arg=action['arg'],
-                            valid=action['valid'],
-                            icon=action['icon'])
-        else:
-            wf.add_item('No action found for "%s"' % query,
-                        autocomplete='',
-                        icon='icons/info-dark.png')
+        elif query and any(query.startswith(x) for x in ['tunnel', 'protocol']):
+            protocol_status()
+
+        elif query:
+            # TODO change from actions dictionary to a filter function
+            actions = mullvad_actions.ACTIONS
+            # filter actions by query
+            if query:
+                actions = wf.filter(query, actions,
+                                    key=helpers.search_key_for_action,
+                                    match_on=MATCH_SUBSTRING)
+
+            if len(actions) > 0:
+                for action in actions:
+                    wf.add_item(action['name'], action['description'],
+                                uid=action['name'],
+                                autocomplete=action['autocomplete'],
+                                arg=action['arg'],
+                                valid=action['valid'],
+                                icon=action['icon'])
+            else:
+                wf.add_item('No action found for "%s"' % query,
+                            autocomplete='',
+                            icon='icons/info-dark.png')
+    except CommandError as err:
+        daemon_unreachable(err.cmdList)
 
     if len(wf._items) == 0:
         query_name = query[query.find(' ') + 1:]
@@ -504,10 +878,17 @@ def main(wf):
                     icon='icons/chevron-right-dark.png')
 
     wf.send_feedback()
+    wf.logger.debug('execute memo: %d hits, %d misses', memoStats['hits'], memoStats['misses'])
+    wf.logger.debug('start screen cache ages: %r', wf.cache_bundle('mullvad_start').ages())
 
     # refresh cache
     cmd = ['/usr/bin/python3', wf.workflowfile('mullvad_refresh.py')]
     run_in_background('mullvad_refresh', cmd)
+    # keep the CLI broker alive for the next keystroke
+    cmd = ['/usr/bin/python3', wf.workflowfile('mullvad_broker.py')]
+    run_in_background(mullvad_broker.BROKER_NAME, cmd)
+    # follow tunnel state changes, so the next run reads the connection status without forking
+    start_watcher()
 #    run_in_background('cache_account', cache_account)
 
 
@@ -516,5 +897,4 @@ def main(wf):
 #############################
 
 if __name__ == '__main__':
-    wf = Workflow() #update_settings={'github_slug': GITHUB_SLUG})
     sys.exit(wf.run(main))
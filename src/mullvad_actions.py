@@ -23,6 +23,14 @@ ACTIONS = [
         'icon': 'icons/browser.png',
         'valid': False
     },
+    {
+        'name': 'server',
+        'description': 'Search relay servers by hostname, IP or protocol',
+        'autocomplete': 'server ',
+        'arg': '',
+        'icon': 'icons/browser.png',
+        'valid': False
+    },
     {
         'name': 'reconnect',
         'description': 'Reconnect to VPN',
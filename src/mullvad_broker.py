@@ -0,0 +1,201 @@
+# python 3
+# encoding: utf-8
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from mullvad_runner import COMMAND_TIMEOUT
+
+BROKER_NAME = 'mullvad_broker'
+BROKER_SOCKET = os.path.join(tempfile.gettempdir(), 'mullvad-broker-{}.sock'.format(os.getuid())) # kept short, AF_UNIX paths are limited to ~104 bytes on macOS
+BROKER_CHANGED = os.path.join(tempfile.gettempdir(), 'mullvad-broker-{}.changed'.format(os.getuid())) # touched after every state change, answers older than it are not served
+BROKER_TIMEOUT = 0.5 # seconds a client waits to reach the broker before falling back to forking `mullvad` itself
+BROKER_REPLY_TIMEOUT = COMMAND_TIMEOUT + BROKER_TIMEOUT # the broker kills a command at COMMAND_TIMEOUT, so it has answered by then
+BROKER_MAX_AGE = 2 # seconds after which an answer is refreshed in the background while it is still served
+BROKER_MAX_STALE = 30 # seconds after which an answer is not served anymore, clients wait for the command instead
+BROKER_IDLE_TIMEOUT = 60 # seconds without clients after which the broker exits
+
+# read-only commands the broker is allowed to answer. Anything that changes mullvad's state is always run directly.
+BROKER_COMMANDS = [
+    ('status',),
+    ('relay', 'get'),
+    ('always-require-vpn', 'get'),
+    ('lan', 'get'),
+    ('auto-connect', 'get'),
+    ('version',),
+    ('account', 'get'),
+]
+
+#############################
+########   CLIENT    ########
+#############################
+
+def brokered(cmdList):
+    """ Whether a command may be answered by the broker
+    Arguments:
+    cmdList -- command line command (list of strings)
+    Returns:
+    Boolean
+    """
+    return tuple(cmdList[1:]) in BROKER_COMMANDS
+
+
+def invalidate():
+    """ Tell a running broker that mullvad's state changed, so it does not serve answers from before the change """
+    try:
+        with open(BROKER_CHANGED, 'a'):
+            os.utime(BROKER_CHANGED)
+    except OSError:
+        pass
+
+
+def changed_at():
+    """ Time of the last state change reported by invalidate() or a `touch` of BROKER_CHANGED
+    Returns:
+    Timestamp, 0 if no change was reported
+    """
+    try:
+        return os.stat(BROKER_CHANGED).st_mtime
+    except OSError:
+        return 0
+
+
+async def ask(cmdList):
+    """ Ask a running broker for the result of a command.
+    Once the broker has the request it is left to run the command, clients don't run it a second time.
+    Arguments:
+    cmdList -- command line command (list of strings)
+    Returns:
+    List of [exit code, stdout, stderr, duration], or None if the command is not brokered, the broker is not running or could not answer
+    """
+    if not brokered(cmdList):
+        return None
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(BROKER_SOCKET), BROKER_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(json.dumps({'argv': cmdList}).encode('utf-8') + b'\n')
+        await writer.drain()
+        reply = await asyncio.wait_for(reader.readline(), BROKER_REPLY_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+    try:
+        return json.loads(reply.decode('utf-8'))['result']
+    except (ValueError, KeyError):
+        return None
+
+
+#############################
+########   SERVER    ########
+#############################
+
+class Broker(object):
+    """ Owns the `mullvad` CLI calls and keeps the latest answer to each in memory.
+    Answers are served right away and refreshed in the background once they are BROKER_MAX_AGE old,
+    so a client only waits for the CLI when there is no answer from after the last state change.
+    """
+
+    def __init__(self, execute):
+        self.execute = execute # function that really runs the CLI
+        self.answers = {} # argv tuple -> (time the command was started, result)
+        self.running = {} # argv tuple -> (time the command was started, Future of its result)
+        self.pool = ThreadPoolExecutor(max_workers=len(BROKER_COMMANDS))
+        self.lock = threading.Lock()
+        self.lastRequest = time.time()
+
+    def run(self, argv, started):
+        result = self.execute(list(argv))
+        with self.lock:
+            if argv not in self.answers or self.answers[argv][0] <= started:
+                self.answers[argv] = (started, result)
+        return result
+
+    def refresh(self, argv):
+        """ Run a command unless it is already running since the last state change
+        Returns:
+        Future of the command's result, shared by every client asking meanwhile
+        """
+        with self.lock:
+            started, future = self.running.get(argv, (0, None))
+            if future is None or future.done() or started <= changed_at():
+                started = time.time() # a change while the command runs may or may not be in its output
+                future = self.pool.submit(self.run, argv, started)
+                self.running[argv] = (started, future)
+        return future
+
+    def answer(self, argv):
+        self.lastRequest = time.time()
+        with self.lock:
+            cached = self.answers.get(argv)
+        # item args change the state from Alfred's shell and touch BROKER_CHANGED when they are done,
+        # the watcher touches it on every tunnel state transition
+        if cached is None or cached[0] <= changed_at() or time.time() - cached[0] >= BROKER_MAX_STALE:
+            return self.refresh(argv).result()
+        if time.time() - cached[0] >= BROKER_MAX_AGE:
+            self.refresh(argv) # fresh for the next render
+        return cached[1]
+
+    def linger(self, server):
+        """ Stop the server once no client has asked for BROKER_IDLE_TIMEOUT seconds.
+        Answers are only refreshed when a client asks for them, never on a timer.
+        """
+        while True:
+            left = self.lastRequest + BROKER_IDLE_TIMEOUT - time.time()
+            if left <= 0:
+                break
+            time.sleep(left)
+        server.shutdown()
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            argv = tuple(json.loads(self.rfile.readline().decode('utf-8'))['argv'])
+        except (ValueError, KeyError, TypeError):
+            return
+        if not brokered(argv):
+            reply = {'error': 'command not brokered'}
+        else:
+            reply = {'result': list(self.server.broker.answer(argv))}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # every render connects once per command at the same time, and overlapping renders add up; past the
+    # listen backlog a non-blocking connect fails right away and the client would run the command itself
+    request_queue_size = 4 * len(BROKER_COMMANDS)
+
+
+def serve(execute):
+    """ Serve `mullvad` answers over BROKER_SOCKET until idle
+    Arguments:
+    execute -- function running a command directly, e.g. mullvad.execute_direct
+    """
+    if os.path.exists(BROKER_SOCKET):
+        os.unlink(BROKER_SOCKET) # left behind by a broker that died
+    server = BrokerServer(BROKER_SOCKET, BrokerHandler)
+    server.broker = Broker(execute)
+    threading.Thread(target=server.broker.linger, args=(server,), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(BROKER_SOCKET)
+
+
+if __name__ == '__main__':
+    import mullvad
+    sys.exit(serve(mullvad.execute_direct))
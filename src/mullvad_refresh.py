@@ -1,11 +1,48 @@
 import mullvad
+import relays
 
 from workflow import Workflow
 
 
 if __name__ == '__main__':
     wf = Workflow()
+    mullvad.wf = wf # the mullvad subroutines read the cache through the module's `wf`
 #    execute('mullvad_update_relay_list', mullvad.update_relay_list())
-    wf.cache_data('mullvad_relay_list', mullvad.get_relay_list())
-    wf.cache_data('mullvad_country_list', get_country_list(wf))
+    try:
+        relayIndex = mullvad.get_relay_list()
+    except mullvad.CommandError as err:
+        wf.logger.warning('%s, keeping the cached relay list', err)
+        raise SystemExit(1)
+    if not len(relayIndex):
+        wf.logger.warning('relay list is empty, keeping the cached one')
+        raise SystemExit(1)
+    oldDigests = wf.cached_data('mullvad_relay_digests', max_age=0, serializer=relays.LISTS_SERIALIZER) or {}
+    newDigests = relays.digests(relayIndex)
+    changedCountries, added, removed, changed = relays.diff_digests(oldDigests, newDigests)
+    wf.logger.info('relay list: %d countries changed, %d servers added, %d removed, %d changed',
+                   len(changedCountries), added, removed, changed)
+    countryLabels = relayIndex.labels()
+    # countries added, removed, reordered or renamed; also repairs a list left stale by older versions
+    countriesChanged = wf.cached_data('mullvad_country_list', max_age=0, serializer=relays.LISTS_SERIALIZER) != countryLabels
+    # the digests match a relay index that no longer loads, e.g. a truncated file: don't mark it as verified
+    indexBroken = wf.cached_data('mullvad_relay_index', max_age=0, serializer=relays.SERIALIZER) is None
+    if changedCountries or countriesChanged or indexBroken:
+        # the relay index is offset-indexed, so any change means one atomic rewrite of the file
+        wf.cache_data('mullvad_relay_index', relayIndex, serializer=relays.SERIALIZER)
+        if countriesChanged:
+            wf.cache_data('mullvad_country_list', countryLabels, serializer=relays.LISTS_SERIALIZER)
+        wf.cache_data('mullvad_city_lists', relays.city_lists(relayIndex), serializer=relays.LISTS_SERIALIZER)
+        wf.cache_data('mullvad_server_list', relays.server_list(relayIndex), serializer=relays.LISTS_SERIALIZER)
+        wf.cache_data('mullvad_relay_digests', newDigests, serializer=relays.LISTS_SERIALIZER)
+    else:
+        # nothing changed: mark the caches as verified instead of rewriting them
+        wf.touch_cached_data('mullvad_relay_index', serializer=relays.SERIALIZER)
+        for name in ('mullvad_country_list', 'mullvad_city_lists', 'mullvad_server_list'):
+            wf.touch_cached_data(name, serializer=relays.LISTS_SERIALIZER)
+    if changedCountries or not relays.search_index_current(wf):
+        # pre-folded filter keys, so the relay views don't fold every name on every keystroke
+        countryKeys, cityKeys, serverKeys = relays.search_index(wf, relayIndex)
+        wf.cache_data('mullvad_search_countries', countryKeys)
+        wf.cache_data('mullvad_search_cities', cityKeys)
+        wf.cache_data('mullvad_search_servers', serverKeys)
 #    wf.cache_data('mullvad_account', mullvad.get_account())
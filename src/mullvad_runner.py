@@ -0,0 +1,184 @@
+# python 3
+# encoding: utf-8
+
+import os
+import time
+import types
+import shutil
+import signal
+import asyncio
+import tempfile
+import threading
+import subprocess
+
+COMMAND_TIMEOUT = 5 # seconds a single command may run before it is killed
+TIMEOUT_EXIT = -1 # exit code reported for a command killed at its deadline
+SEARCH_PATH = '/usr/local/bin' # where the Mullvad app links its CLI, searched before $PATH
+BINARY_VARIABLE = 'mullvad_bin' # workflow variable with the path of the `mullvad` CLI, overrides the search
+
+#############################
+######## RUNNER      ########
+#############################
+
+class Runner(object):
+    """ Runs `mullvad` commands with the binary and the environment resolved once per process
+    Arguments:
+    binary -- path of the `mullvad` CLI; the BINARY_VARIABLE workflow variable or a search of
+              SEARCH_PATH and $PATH if None
+    posixSpawn -- launch commands with posix_spawn instead of fork/exec. Cheaper, but the command
+                  does not get its own process group, so at a deadline only the command itself is
+                  killed and not any children it started
+    """
+
+    def __init__(self, binary=None, posixSpawn=False):
+        env = os.environ.copy()
+        env['PATH'] = '{}:{}'.format(SEARCH_PATH, env.get('PATH', '')) # Alfred's PATH does not include it
+        self.env = types.MappingProxyType(env) # frozen, every command shares it
+        self._binary = binary or os.environ.get(BINARY_VARIABLE) or None
+        self.posixSpawn = posixSpawn
+
+    @property
+    def binary(self):
+        """ Absolute path of the `mullvad` CLI, looked up on first use """
+        if self._binary is None:
+            self._binary = shutil.which('mullvad', path=self.env['PATH']) or os.path.join(SEARCH_PATH, 'mullvad')
+        return self._binary
+
+    def argv(self, cmdList):
+        """ cmdList with a leading 'mullvad' replaced by the absolute path of the CLI """
+        if cmdList and cmdList[0] == 'mullvad':
+            return [self.binary] + list(cmdList[1:])
+        return list(cmdList)
+
+    def spawn_options(self):
+        """ Popen keyword arguments selecting how commands are launched.
+        CPython only takes its posix_spawn path for absolute executables and without close_fds or a new
+        session; the pipes it creates are non-inheritable, so leaving other descriptors open is safe.
+        """
+        if self.posixSpawn:
+            return {'close_fds': False}
+        return {'start_new_session': True} # own process group, see terminate()
+
+    async def run_command(self, cmdList, timeout=COMMAND_TIMEOUT):
+        """ Run a terminal command without blocking the event loop
+        Arguments:
+        cmdList -- command line command (list of strings)
+        timeout -- seconds after which the command is killed
+        Returns:
+        Tuple of (exit code, stdout, stderr, duration); the exit code is TIMEOUT_EXIT if the command was killed
+        """
+        start = time.time()
+        try:
+            proc = await asyncio.create_subprocess_exec(*self.argv(cmdList),
+                                                        stdout=subprocess.PIPE,
+                                                        stderr=subprocess.PIPE,
+                                                        env=self.env,
+                                                        **self.spawn_options())
+        except OSError as err: # e.g. the executable is not installed
+            return (127, '', str(err), time.time() - start)
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await self.kill(proc)
+            return (TIMEOUT_EXIT, '', '{} did not answer within {}s'.format(' '.join(cmdList), timeout), time.time() - start)
+        except asyncio.CancelledError:
+            await self.kill(proc)
+            raise
+        return (proc.returncode, out.decode('utf-8', 'replace'), err.decode('utf-8', 'replace'), time.time() - start)
+
+    def terminate(self, proc):
+        """ Kill a command that is still running.
+        Without posixSpawn the whole process group is killed, which also stops children (e.g. of a
+        wrapper script) that would keep the pipes open.
+        """
+        try:
+            if self.posixSpawn:
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def kill(self, proc):
+        """ terminate() a command and reap it """
+        if proc.returncode is None:
+            self.terminate(proc)
+        await proc.wait()
+
+    async def run_commands(self, cmdLists, timeout=COMMAND_TIMEOUT, budget=None, ask=None):
+        """ Run terminal commands concurrently
+        Arguments:
+        cmdLists -- list of command line commands
+        timeout -- seconds after which a single command is killed
+        budget -- seconds after which every command still running is cancelled, None to wait for all of them.
+                  Includes the time spent in ask
+        ask -- coroutine function tried before running each command, returning a result like run_command()
+               or None to run the command, e.g. mullvad_broker.ask
+        Returns:
+        List of run_command() results in the order of cmdLists, None for cancelled commands
+        """
+        async def answer(cmdList):
+            result = await ask(cmdList) if ask else None
+            if result is None:
+                result = await self.run_command(cmdList, timeout)
+            return result
+
+        tasks = [asyncio.ensure_future(answer(cmdList)) for cmdList in cmdLists]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=budget)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True) # let cancelled commands kill their processes
+        return [task.result() if task in done else None for task in tasks]
+
+    def run(self, cmdList, timeout=COMMAND_TIMEOUT):
+        """ Blocking run_command() for synchronous callers """
+        return asyncio.run(self.run_command(cmdList, timeout))
+
+    def run_many(self, cmdLists, timeout=COMMAND_TIMEOUT, budget=None, ask=None):
+        """ Blocking run_commands() for synchronous callers """
+        return asyncio.run(self.run_commands(cmdLists, timeout, budget, ask))
+
+    def lines(self, cmdList, timeout=COMMAND_TIMEOUT):
+        """ Run a terminal command and yield its stdout lines while it is still running
+        Arguments:
+        cmdList -- command line command (list of strings)
+        timeout -- seconds after which the command is killed, None for streams that never end on their own
+        Yields:
+        Lines of stdout without their line endings; the returned StopIteration value is a tuple of
+        (exit code, stderr), the exit code is TIMEOUT_EXIT if the command was killed at its deadline.
+        Closing the generator before the command has finished kills it.
+        """
+        expired = threading.Event()
+
+        def expire(proc):
+            expired.set()
+            self.terminate(proc)
+
+        # stderr goes to a file: a pipe read after stdout would block the command once it fills up
+        with tempfile.TemporaryFile() as errors, \
+             subprocess.Popen(self.argv(cmdList),
+                              stdout=subprocess.PIPE,
+                              stderr=errors,
+                              text=True,
+                              env=self.env,
+                              **self.spawn_options()) as proc:
+            watchdog = threading.Timer(timeout, expire, (proc,)) if timeout is not None else None
+            if watchdog:
+                watchdog.daemon = True
+                watchdog.start() # the output is read on this thread, so a silent command is killed from another one
+            try:
+                for line in proc.stdout:
+                    yield line.rstrip('\n')
+            finally:
+                if watchdog:
+                    watchdog.cancel()
+                if proc.poll() is None: # closed early, e.g. a stream that never ends on its own
+                    self.terminate(proc)
+            proc.wait()
+            errors.seek(0)
+            stderr = errors.read().decode('utf-8', 'replace')
+        if expired.is_set():
+            return (TIMEOUT_EXIT, '{} did not answer within {}s'.format(' '.join(cmdList), timeout))
+        return (proc.returncode, stderr)
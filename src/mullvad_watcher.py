@@ -0,0 +1,128 @@
+# python 3
+# encoding: utf-8
+
+import sys
+import time
+import signal
+
+import mullvad_broker
+
+WATCHER_NAME = 'mullvad_watcher'
+WATCHER_CACHE = 'mullvad_watched_status' # cache of the latest tunnel state, read by the Script Filter without forking `mullvad`
+WATCHER_LIFETIME = 600 # seconds after which the watcher exits; the next Script Filter run starts a new one
+LISTEN_COMMAND = ['mullvad', 'status', 'listen']
+STATUS_COMMAND = ['mullvad', 'status']
+ENDED_EXIT = 1 # exit code recorded for a stream that ended by itself, even if `mullvad` exited with 0
+
+# first words of the sentences `mullvad status` prints for each tunnel state
+TUNNEL_STATES = ('Connected', 'Connecting', 'Disconnected', 'Disconnecting', 'Blocked:', 'Error:')
+STATE_PREFIX = 'New tunnel state: ' # older CLIs prefix every streamed transition with this
+
+#############################
+########   CLIENT    ########
+#############################
+
+def watched_status(wf):
+    """ Latest tunnel state reported by a running watcher
+    Arguments:
+    wf -- Workflow instance whose cache the watcher writes to
+    Returns:
+    List of status sentence lines like get_connection(), or None if no watcher is running or it has not reported yet
+    """
+    from workflow.background import is_running # checks the job's pid with kill(0), does not fork
+    watched = wf.cached_data(WATCHER_CACHE, max_age=0)
+    if not watched or not is_running(WATCHER_NAME):
+        return None # the watcher died without clearing its last state: poll instead
+    return watched['status']
+
+
+def parse_state(line):
+    """ Tunnel state sentence of a line of `mullvad status listen` output
+    Arguments:
+    line -- line of output without its line ending
+    Returns:
+    String of the status sentence, or None for lines that are not a state transition
+    """
+    if line.startswith(STATE_PREFIX):
+        line = line[len(STATE_PREFIX):]
+    line = line.strip()
+    if line.split(' ', 1)[0] in TUNNEL_STATES:
+        return line
+    return None
+
+
+#############################
+########   WATCHER   ########
+#############################
+
+def write_status(wf, status):
+    """ Store the latest tunnel state for watched_status()
+    Arguments:
+    wf -- Workflow instance
+    status -- list of status sentence lines, None to make readers poll
+    """
+    if status is None:
+        wf.cache_data(WATCHER_CACHE, None)
+    else:
+        wf.cache_data(WATCHER_CACHE, {'time': time.time(), 'status': status})
+
+
+class Stopped(Exception):
+    """ Raised by SIGALRM once the watcher has run for WATCHER_LIFETIME, and by SIGTERM """
+
+
+def stop(signum, frame):
+    raise Stopped(signal.Signals(signum).name)
+
+
+def watch(wf):
+    """ Follow `mullvad status listen` and cache every state transition until the stream ends or WATCHER_LIFETIME passes.
+    Both commands go through mullvad's failure backoff, which mullvad.start_watcher() checks before starting a watcher.
+    Arguments:
+    wf -- Workflow instance, mullvad.wf
+    Returns:
+    Exit code of the watcher
+    """
+    import mullvad # imports this module, so not at the top
+    write_status(wf, None) # a state left by a watcher that was killed is not trusted by readers either way
+    # the stream only reports transitions, so start from the current state
+    result = mullvad.execute(STATUS_COMMAND)
+    if not result.ok:
+        wf.logger.warning('%s failed with exit code %d: %s', ' '.join(STATUS_COMMAND), result.returncode, result.stderr.strip())
+        return 1
+    write_status(wf, result.stdout.splitlines())
+    start = time.time()
+    stream = mullvad.runner.lines(LISTEN_COMMAND, timeout=None) # runs until WATCHER_LIFETIME, see below
+    signal.signal(signal.SIGALRM, stop)
+    signal.signal(signal.SIGTERM, stop) # e.g. background.kill(): clean up like at the end of the lifetime
+    signal.alarm(WATCHER_LIFETIME) # the stream can stay quiet for hours, so don't wait for a line to check the time
+    try:
+        while True:
+            try:
+                line = next(stream)
+            except StopIteration as end:
+                returncode, stderr = end.value
+                break
+            status = parse_state(line)
+            if status is not None:
+                wf.logger.debug('tunnel state: %s', status)
+                write_status(wf, [status])
+                mullvad_broker.invalidate() # the broker's answers, e.g. to `status`, are from before the transition
+        # the stream only ends on its own if the daemon went away or the CLI can't stream:
+        # back off like from a failed command, instead of starting a new watcher on every keystroke
+        result = mullvad.CommandResult(returncode or ENDED_EXIT, '', stderr or '{} ended'.format(' '.join(LISTEN_COMMAND)),
+                                       time.time() - start)
+        mullvad.record_result(LISTEN_COMMAND, result)
+    except Stopped as err:
+        wf.logger.debug('watcher stopped by %s', err)
+        mullvad.record_result(LISTEN_COMMAND, mullvad.CommandResult(0, '', '', time.time() - start)) # forget earlier failures
+    finally:
+        signal.alarm(0)
+        stream.close() # kills `status listen` if it is still running
+        write_status(wf, None) # whatever happens next, readers must not trust the last state
+    return 0
+
+
+if __name__ == '__main__':
+    import mullvad
+    sys.exit(watch(mullvad.wf))
@@ -0,0 +1,418 @@
+# python 3
+# encoding: utf-8
+
+import re
+import mmap
+import hashlib
+import struct
+
+from workflow.workflow import BaseSerializer, MarshalSerializer, SchemaMismatch, SearchIndex, manager
+
+COUNTRY_LINE = re.compile(r'^(.*?) \((\w+)\)$') # Sweden (se)
+CITY_LINE = re.compile(r'^(.*?) \((\w+)\)') # Gothenburg (got) @ 57.70887°N, 11.97456°W
+SERVER_LINE = re.compile(r'^(\S+) \(([^)]*)\)(?: - ([^,]+))?(?:, (.*))?$') # se-got-wg-001 (185.213.154.66, 2a03:...) - WireGuard, hosted by ...
+
+SERIALIZER = 'relays' # name registered with workflow.manager, also the cache file extension
+LISTS_SERIALIZER = 'relaylists' # serializer of the lists derived from the relay index
+FORMAT_MAGIC = b'MVRL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIIII') # magic, version, reserved, countries, cities, servers, strings
+RECORD = struct.Struct('<IIII') # country: name, code, first city, cities / city: name, code, first server, servers / server: hostname, addresses, protocol, details
+OFFSET = struct.Struct('<I')
+
+#############################
+######## RECORDS     ########
+#############################
+
+class Server(object):
+    """ A single relay server, e.g. se-got-wg-001 """
+    __slots__ = ('hostname', 'addresses', 'protocol', 'details')
+
+    def __init__(self, hostname, addresses=(), protocol='', details=''):
+        self.hostname = hostname
+        self.addresses = tuple(addresses)
+        self.protocol = protocol
+        self.details = details
+
+    def __repr__(self):
+        return 'Server({!r})'.format(self.hostname)
+
+
+class City(object):
+    """ A city with relays, e.g. Gothenburg (got) """
+    __slots__ = ('name', 'code', 'servers')
+
+    def __init__(self, name, code, servers=None):
+        self.name = name
+        self.code = code
+        self.servers = servers or []
+
+    @property
+    def label(self):
+        return '{} ({})'.format(self.name, self.code)
+
+    def __repr__(self):
+        return 'City({!r})'.format(self.label)
+
+
+class Country(object):
+    """ A country with relays, e.g. Sweden (se) """
+    __slots__ = ('name', 'code', 'cities')
+
+    def __init__(self, name, code, cities=None):
+        self.name = name
+        self.code = code
+        self.cities = cities or []
+
+    @property
+    def label(self):
+        return '{} ({})'.format(self.name, self.code)
+
+    def __repr__(self):
+        return 'Country({!r})'.format(self.label)
+
+
+class RelayIndex(object):
+    """ Countries in `mullvad relay list` order, with lookups by country code and (country code, city code) """
+    __slots__ = ('countries', 'byCountry', 'byCity')
+
+    def __init__(self, countries):
+        self.countries = list(countries)
+        self.byCountry = {}
+        self.byCity = {}
+        for country in self.countries:
+            self.byCountry[country.code] = country
+            for city in country.cities:
+                self.byCity[(country.code, city.code)] = city
+
+    def country(self, code):
+        """ Country for a two letter country code, or None """
+        return self.byCountry.get(code)
+
+    def city(self, countryCode, cityCode):
+        """ City for a country code and three letter city code, or None """
+        return self.byCity.get((countryCode, cityCode))
+
+    def labels(self):
+        """ List of country labels, e.g. ['Albania (al)', ...] """
+        return [country.label for country in self.countries]
+
+    def __len__(self):
+        return len(self.countries)
+
+
+class MappedRelayIndex(object):
+    """ RelayIndex look-alike reading the binary cache format through a memory map.
+    Only the records a lookup needs are decoded, e.g. country(code) materializes a single country.
+    """
+
+    def __init__(self, buf):
+        """ Raises SchemaMismatch for another format or a file too short for its tables, e.g. a truncated one """
+        self.buf = buf
+        try:
+            magic, version, _, self.nCountries, self.nCities, self.nServers, self.nStrings = HEADER.unpack_from(buf, 0)
+        except struct.error:
+            raise SchemaMismatch('truncated header')
+        if magic != FORMAT_MAGIC or version != FORMAT_VERSION:
+            raise SchemaMismatch('not a version {} relay list'.format(FORMAT_VERSION))
+        self.countryTable = HEADER.size
+        self.cityTable = self.countryTable + self.nCountries * RECORD.size
+        self.serverTable = self.cityTable + self.nCities * RECORD.size
+        self.offsetTable = self.serverTable + self.nServers * RECORD.size
+        self.stringTable = self.offsetTable + (self.nStrings + 1) * OFFSET.size
+        end = self.stringTable
+        if len(buf) >= end:
+            end += OFFSET.unpack_from(buf, end - OFFSET.size)[0] # the last string offset is the length of the string blob
+        if len(buf) < end:
+            raise SchemaMismatch('truncated relay list')
+        self._byCountry = None
+
+    def string(self, sid):
+        start, = OFFSET.unpack_from(self.buf, self.offsetTable + sid * OFFSET.size)
+        end, = OFFSET.unpack_from(self.buf, self.offsetTable + (sid + 1) * OFFSET.size)
+        return self.buf[self.stringTable + start:self.stringTable + end].decode('utf-8')
+
+    def record(self, table, i):
+        return RECORD.unpack_from(self.buf, table + i * RECORD.size)
+
+    def server(self, i):
+        hostname, addresses, protocol, details = self.record(self.serverTable, i)
+        addresses = self.string(addresses)
+        return Server(self.string(hostname),
+                      addresses.split(', ') if addresses else (),
+                      self.string(protocol),
+                      self.string(details))
+
+    def load_country(self, i):
+        name, code, firstCity, nCities = self.record(self.countryTable, i)
+        cities = []
+        for j in range(firstCity, firstCity + nCities):
+            cityName, cityCode, firstServer, nServers = self.record(self.cityTable, j)
+            cities.append(City(self.string(cityName),
+                               self.string(cityCode),
+                               [self.server(k) for k in range(firstServer, firstServer + nServers)]))
+        return Country(self.string(name), self.string(code), cities)
+
+    @property
+    def byCountry(self):
+        """ Country code -> position in the country table, built from the country table only """
+        if self._byCountry is None:
+            self._byCountry = {self.string(self.record(self.countryTable, i)[1]): i for i in range(self.nCountries)}
+        return self._byCountry
+
+    @property
+    def countries(self):
+        return [self.load_country(i) for i in range(self.nCountries)]
+
+    def country(self, code):
+        i = self.byCountry.get(code)
+        if i is None:
+            return None
+        return self.load_country(i)
+
+    def city(self, countryCode, cityCode):
+        country = self.country(countryCode)
+        if country is None:
+            return None
+        for city in country.cities:
+            if city.code == cityCode:
+                return city
+        return None
+
+    def labels(self):
+        labels = []
+        for i in range(self.nCountries):
+            name, code, _, _ = self.record(self.countryTable, i)
+            labels.append('{} ({})'.format(self.string(name), self.string(code)))
+        return labels
+
+    def __len__(self):
+        return self.nCountries
+
+
+class RelaySerializer(BaseSerializer):
+    """ Cache serializer writing a RelayIndex as offset-indexed binary tables:
+    header, country table, city table, server table, string offsets, string blob.
+    load() memory-maps the file and returns a MappedRelayIndex.
+    """
+    is_binary = True
+
+    @classmethod
+    def load(cls, file_obj):
+        try:
+            buf = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            raise SchemaMismatch('empty relay list')
+        return MappedRelayIndex(buf)
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        strings = {}
+        def sid(text):
+            return strings.setdefault(text, len(strings))
+
+        countryRecords, cityRecords, serverRecords = [], [], []
+        for country in obj.countries:
+            countryRecords.append((sid(country.name), sid(country.code), len(cityRecords), len(country.cities)))
+            for city in country.cities:
+                cityRecords.append((sid(city.name), sid(city.code), len(serverRecords), len(city.servers)))
+                for server in city.servers:
+                    serverRecords.append((sid(server.hostname), sid(', '.join(server.addresses)),
+                                          sid(server.protocol), sid(server.details)))
+
+        blob = [text.encode('utf-8') for text in strings] # dicts keep insertion order, i.e. string id order
+        file_obj.write(HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, 0, len(countryRecords),
+                                   len(cityRecords), len(serverRecords), len(blob)))
+        for record in countryRecords + cityRecords + serverRecords:
+            file_obj.write(RECORD.pack(*record))
+        offset = 0
+        file_obj.write(OFFSET.pack(offset))
+        for data in blob:
+            offset += len(data)
+            file_obj.write(OFFSET.pack(offset))
+        file_obj.write(b''.join(blob))
+
+
+class RelayListsSerializer(MarshalSerializer):
+    """ Versioned marshal files for the country list, city lists, server list and digests.
+    Bump schema whenever the shape of city_lists(), server_list() or digests() changes,
+    so caches written by an older version are regenerated instead of loaded.
+    """
+    schema = 1
+
+
+manager.register(SERIALIZER, RelaySerializer)
+manager.register(LISTS_SERIALIZER, RelayListsSerializer)
+
+
+#############################
+######## PARSING     ########
+#############################
+
+def parse_server(line):
+    """ Server record from a server line of `mullvad relay list` (without the leading tabs) """
+    match = SERVER_LINE.match(line)
+    if not match:
+        tokens = line.split()
+        return Server(tokens[0], details=' '.join(tokens[1:]))
+    hostname, addresses, protocol, details = match.groups()
+    return Server(hostname,
+                  [address.strip() for address in addresses.split(',')],
+                  protocol or '',
+                  details or '')
+
+
+def iter_records(lines):
+    """ Parse the lines of `mullvad relay list` as they are read
+    Arguments:
+    lines -- iterable of output lines, e.g. a subprocess pipe
+    Yields:
+    Country, City and Server records in listing order. Each city is already attached to
+    its country and each server to its city, so the tree grows as records are yielded.
+    """
+    country = city = None
+    for line in lines:
+        if not line.strip(): # empty line between countries
+            continue
+        if line[0] != '\t': # country
+            match = COUNTRY_LINE.match(line.strip())
+            if match:
+                country = Country(match.group(1), match.group(2))
+            else:
+                country = Country(line.strip(), '')
+            city = None
+            yield country
+        elif line[1] != '\t' and country is not None: # city
+            match = CITY_LINE.match(line.strip())
+            if match:
+                city = City(match.group(1), match.group(2))
+            else:
+                city = City(line.split('@')[0].strip(), '')
+            country.cities.append(city)
+            yield city
+        elif city is not None: # server
+            server = parse_server(line.strip())
+            city.servers.append(server)
+            yield server
+
+
+def iter_countries(lines):
+    """ Yield each Country of `mullvad relay list` as soon as all of its cities and servers are read """
+    country = None
+    for record in iter_records(lines):
+        if isinstance(record, Country):
+            if country is not None:
+                yield country
+            country = record
+    if country is not None:
+        yield country
+
+
+def parse_relay_list(lines):
+    """ Build a RelayIndex from the lines of `mullvad relay list`
+    Arguments:
+    lines -- iterable of output lines
+    Returns:
+    RelayIndex
+    """
+    return RelayIndex(iter_countries(lines))
+
+
+#############################
+######## SEARCHING   ########
+#############################
+
+def city_lists(relayIndex):
+    """ Dictionary of country code -> list of city labels, e.g. {'se': ['Gothenburg (got)', ...]} """
+    return {country.code: [city.label for city in country.cities] for country in relayIndex.countries}
+
+
+def server_list(relayIndex):
+    """ Flat list of every server for the server search
+    Arguments:
+    relayIndex -- RelayIndex or MappedRelayIndex
+    Returns:
+    List of tuples (search text, hostname, country code, city code, city name, country name, protocol, addresses),
+    where the search text is the hostname, addresses and protocol joined by spaces
+    """
+    servers = []
+    for country in relayIndex.countries:
+        for city in country.cities:
+            for server in city.servers:
+                searchText = ' '.join((server.hostname,) + server.addresses + (server.protocol,)).strip()
+                servers.append((searchText, server.hostname, country.code, city.code, city.name, country.name,
+                                server.protocol, ', '.join(server.addresses)))
+    return servers
+
+
+def search_index(wf, relayIndex):
+    """ Precomputed workflow.workflow.SearchIndex key lists for Workflow.filter(..., keys=...)
+    Arguments:
+    wf -- Workflow
+    relayIndex -- RelayIndex or MappedRelayIndex
+    Returns:
+    Tuple of (keys of country labels, {country code: keys of city labels}, keys of server search texts)
+    """
+    countries = relayIndex.countries
+    countryKeys = wf.search_keys(country.label for country in countries)
+    cityKeys = {country.code: wf.search_keys(city.label for city in country.cities) for country in countries}
+    serverKeys = wf.search_keys(server[0] for server in server_list(relayIndex))
+    return countryKeys, cityKeys, serverKeys
+
+
+def search_index_current(wf):
+    """ Whether the cached filter keys are SearchIndexes, which older versions did not write
+    Arguments:
+    wf -- Workflow
+    Returns:
+    Boolean
+    """
+    return isinstance(wf.cached_data('mullvad_search_servers', max_age=0), SearchIndex)
+
+
+#############################
+######## DIFFING     ########
+#############################
+
+def server_digest(server):
+    return hashlib.sha1('\t'.join((server.hostname, ', '.join(server.addresses),
+                                    server.protocol, server.details)).encode('utf-8')).hexdigest()
+
+
+def digests(relayIndex):
+    """ Content hashes of a relay index
+    Arguments:
+    relayIndex -- RelayIndex or MappedRelayIndex
+    Returns:
+    Dictionary of country code -> (country hash, {hostname: server hash}), in relay list order
+    """
+    result = {}
+    for country in relayIndex.countries:
+        countryHash = hashlib.sha1(country.label.encode('utf-8'))
+        servers = {}
+        for city in country.cities:
+            countryHash.update(city.label.encode('utf-8'))
+            for server in city.servers:
+                servers[server.hostname] = server_digest(server)
+                countryHash.update(servers[server.hostname].encode('ascii'))
+        result[country.code] = (countryHash.hexdigest(), servers)
+    return result
+
+
+def diff_digests(old, new):
+    """ Compare two results of digests()
+    Returns:
+    Tuple of (codes of added/removed/changed countries, servers added, servers removed, servers changed)
+    """
+    changedCountries = []
+    added = removed = changed = 0
+    for code in set(old) | set(new):
+        oldHash, oldServers = old.get(code, (None, {}))
+        newHash, newServers = new.get(code, (None, {}))
+        if oldHash == newHash:
+            continue
+        changedCountries.append(code)
+        added += len(newServers.keys() - oldServers.keys())
+        removed += len(oldServers.keys() - newServers.keys())
+        changed += len([host for host in newServers.keys() & oldServers.keys() if newServers[host] != oldServers[host]])
+    return sorted(changedCountries), added, removed, changed
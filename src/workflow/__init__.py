@@ -17,7 +17,7 @@ from .workflow import Workflow, manager
 from .workflow3 import Variables, Workflow3
 
 # Exceptions
-from .workflow import PasswordNotFound, KeychainError
+from .workflow import PasswordNotFound, KeychainError, SchemaMismatch
 
 # Icons
 from .workflow import (
@@ -73,6 +73,7 @@ __all__ = [
     'manager',
     'PasswordNotFound',
     'KeychainError',
+    'SchemaMismatch',
     'ICON_ACCOUNT',
     'ICON_BURN',
     'ICON_CLOCK',
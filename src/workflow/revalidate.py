@@ -0,0 +1,150 @@
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""Refresh expired caches in a background process.
+
+Used by :meth:`Workflow.cached_data() <workflow.Workflow.cached_data>` and
+:meth:`CacheBundle.get() <workflow.workflow.CacheBundle.get>` when called
+with ``stale_while_revalidate=True``: the expired data are returned
+immediately and ``data_func`` is re-run by this module via
+:func:`~workflow.background.run_in_background`.
+
+As the job runs in a new process, ``data_func`` must be a module-level
+function, so it can be imported again by name.
+"""
+
+
+import importlib
+import importlib.util
+import os
+import sys
+
+from workflow import Workflow
+from workflow.background import run_in_background
+
+__all__ = ['revalidate']
+
+_wf = None
+
+
+def wf():
+    global _wf
+    if _wf is None:
+        _wf = Workflow()
+    return _wf
+
+
+def _function_path(data_func):
+    """Return ``(module, qualname)`` to re-import ``data_func`` by.
+
+    ``module`` is the module's name or, for functions of the script
+    being run, the path to its file.
+
+    :param data_func: function to locate
+    :type data_func: ``callable``
+    :returns: ``(module, qualname)`` or ``None`` if ``data_func``
+        can't be imported by name (lambdas, nested functions etc.)
+    :rtype: ``tuple``
+
+    """
+    module = getattr(data_func, '__module__', None)
+    qualname = getattr(data_func, '__qualname__', None)
+    if not module or not qualname or '<' in qualname:
+        return None
+
+    if module == '__main__':
+        path = getattr(sys.modules['__main__'], '__file__', None)
+        if not path:
+            return None
+        module = os.path.abspath(path)
+
+    return module, qualname
+
+
+def _import_function(module, qualname):
+    """Import function ``qualname`` from ``module``.
+
+    :param module: name of module or path to its file
+    :param qualname: qualified name of function within ``module``
+    :returns: the function
+    :rtype: ``callable``
+
+    """
+    if module.endswith('.py'):
+        dirname, filename = os.path.split(module)
+        sys.path.insert(0, dirname)
+        name = os.path.splitext(filename)[0]
+        if name in sys.modules:
+            obj = sys.modules[name]
+        else:
+            spec = importlib.util.spec_from_file_location(name, module)
+            obj = importlib.util.module_from_spec(spec)
+            sys.modules[name] = obj
+            spec.loader.exec_module(obj)
+    else:
+        obj = importlib.import_module(module)
+
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+
+    return obj
+
+
+def _job_name(name, bundle=None):
+    """Return background job name for refreshing cache ``name``."""
+    if bundle:
+        return 'revalidate.%s.%s' % (bundle, name)
+    return 'revalidate.%s' % name
+
+
+def revalidate(name, data_func, serializer, bundle=None):
+    """Re-generate cache ``name`` with ``data_func`` in the background.
+
+    Only one job per cache runs at a time; calls made while the job
+    is still running are ignored.
+
+    :param name: name of datastore (or entry of ``bundle``)
+    :param data_func: module-level function to re-generate data
+    :type data_func: ``callable``
+    :param serializer: name of serializer to save data with
+    :param bundle: name of :class:`~workflow.workflow.CacheBundle`
+        ``name`` is an entry of, if any
+    :returns: ``True`` if the refresh was scheduled, ``False`` if
+        ``data_func`` can't be run in another process
+    :rtype: ``bool``
+
+    """
+    path = _function_path(data_func)
+    if path is None:
+        return False
+
+    cmd = [sys.executable, '-m', 'workflow.revalidate',
+           name, serializer, path[0], path[1]]
+    if bundle:
+        cmd.append(bundle)
+
+    run_in_background(_job_name(name, bundle), cmd)
+    return True
+
+
+def main(wf):  # pragma: no cover
+    """Re-generate and save cache named by the command-line arguments."""
+    args = wf.args
+    name, serializer, module, qualname = args[:4]
+    bundle = args[4] if len(args) > 4 else None
+
+    data_func = _import_function(module, qualname)
+    data = data_func()
+
+    if bundle:
+        wf.cache_bundle(bundle, serializer).set(name, data)
+    else:
+        wf.cache_data(name, data, serializer)
+
+    wf.logger.debug('[%s] revalidated', _job_name(name, bundle))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    wf().run(main)
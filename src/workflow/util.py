@@ -454,15 +454,17 @@ def atomic_writer(fpath, mode):
     """
     suffix = '.{}.tmp'.format(os.getpid())
     temppath = fpath + suffix
-    with open(temppath, mode) as fp:
-        try:
+    try:
+        with open(temppath, mode) as fp:
             yield fp
-            os.rename(temppath, fpath)
-        finally:
-            try:
-                os.remove(temppath)
-            except (OSError, IOError):
-                pass
+        # only rename the file once it's closed (i.e. flushed), so
+        # readers never see partially-written data
+        os.rename(temppath, fpath)
+    finally:
+        try:
+            os.remove(temppath)
+        except (OSError, IOError):
+            pass
 
 
 class LockFile(object):
@@ -22,19 +22,27 @@ up your Python script to best utilise the :class:`Workflow` object.
 
 
 import binascii
+from bisect import bisect_right
+from collections import OrderedDict
 from contextlib import contextmanager
 from copy import deepcopy
+from functools import lru_cache
+import heapq
+import hashlib
 import json
 import logging
 import logging.handlers
+import marshal
 import os
 import pickle
 import plistlib
 import re
 import shutil
 import string
+import struct
 import subprocess
 import sys
+import threading
 import time
 from typing import Optional
 import unicodedata
@@ -391,6 +399,12 @@ ASCII_REPLACEMENTS = {
     'ỹ': 'y',
 }
 
+# :meth:`str.translate` table of ``ASCII_REPLACEMENTS``
+_ASCII_TABLE = str.maketrans(ASCII_REPLACEMENTS)
+
+#: Number of folded strings :func:`fold_to_ascii` remembers
+FOLD_CACHE_SIZE = 4096
+
 ####################################################################
 # Smart-to-dumb punctuation mapping
 ####################################################################
@@ -448,6 +462,27 @@ MATCH_ALL = 127
 DEFAULT_UPDATE_FREQUENCY = 1
 
 
+####################################################################
+# Used by `Workflow.cached_data`
+####################################################################
+
+#: Default number of deserialized caches :meth:`Workflow.cached_data`
+#: keeps in memory
+DEFAULT_MEMORY_CACHE_SIZE = 32
+
+#: Default number of seconds :meth:`Workflow.cached_data` waits for
+#: another process to finish re-generating a missing cache
+DEFAULT_CACHE_LOCK_TIMEOUT = 5.0
+
+#: Number of seconds :meth:`Workflow.filter` remembers which items
+#: matched an ``incremental`` query
+FILTER_STATE_MAX_AGE = 60
+
+#: Name of the file in :attr:`Workflow.cachedir` recording the
+#: modification time, size, serializer and schema of each cache file
+CACHE_MANIFEST = '.manifest.json'
+
+
 ####################################################################
 # Keychain access errors
 ####################################################################
@@ -482,6 +517,16 @@ class PasswordExists(KeychainError):
     """
 
 
+class SchemaMismatch(ValueError):
+    """Cache file has a different format or schema than expected.
+
+    Raised by serializers that version their files, e.g.
+    :class:`MarshalSerializer`. :meth:`Workflow.cached_data` treats
+    it as a cache miss.
+
+    """
+
+
 ####################################################################
 # Helper functions
 ####################################################################
@@ -495,11 +540,53 @@ def isascii(text):
     :rtype: ``Boolean``
 
     """
-    try:
-        text.encode('ascii')
-    except UnicodeEncodeError:
-        return False
-    return True
+    return text.isascii()
+
+
+def fold_to_ascii(text):
+    """Convert non-ASCII characters to closest ASCII equivalent.
+
+    See :meth:`Workflow.fold_to_ascii`.
+
+    :param text: text to convert
+    :type text: ``unicode``
+    :returns: text containing only ASCII characters
+    :rtype: ``unicode``
+
+    """
+    if isascii(text):
+        return text
+    return _fold_to_ascii(text)
+
+
+@lru_cache(maxsize=FOLD_CACHE_SIZE)
+def _fold_to_ascii(text):
+    """Fold non-ASCII ``text`` for :func:`fold_to_ascii`.
+
+    Memoized, as the same search keys are folded on every query.
+
+    """
+    return unicodedata.normalize('NFKD', text.translate(_ASCII_TABLE))
+
+
+_numpy_module = UNSET
+
+
+def _numpy():
+    """Return the :mod:`numpy` module or ``None`` if it isn't installed.
+
+    Imported on first use, as importing it takes longer than most
+    Script Filters run.
+
+    """
+    global _numpy_module
+    if _numpy_module is UNSET:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module = numpy
+    return _numpy_module
 
 
 ####################################################################
@@ -687,10 +774,562 @@ class PickleSerializer(BaseSerializer):
         return pickle.dump(obj, file_obj, protocol=-1)
 
 
+class MarshalSerializer(BaseSerializer):
+    """Wrapper around :mod:`marshal` with a versioned, checksummed header.
+
+    Loads and dumps plain data (``str``, ``bytes``, numbers, ``None``
+    and lists, tuples, dicts and sets of these) faster than ``pickle``
+    or ``json``. Every file starts with a header holding a magic number,
+    the :mod:`marshal` format version, :attr:`schema` and a CRC32 of
+    the data. :meth:`load` raises :class:`SchemaMismatch` if any of
+    them don't match, so changing the shape of cached data only
+    requires bumping :attr:`schema` in a subclass::
+
+        class MySerializer(MarshalSerializer):
+            schema = 2
+
+        manager.register('mydata', MySerializer)
+
+    """
+    is_binary = True
+
+    #: Version of the data's shape. Bump it when the data change shape.
+    schema = 1
+
+    magic = b'AWMS'
+    header = struct.Struct('<4sHHII')  # magic, format, schema, crc32, size
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open marshal file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from marshal file
+        :rtype: object
+        :raises: :class:`SchemaMismatch` if the header doesn't match
+            or the data are corrupt
+
+        """
+        buf = file_obj.read()
+        if len(buf) < cls.header.size:
+            raise SchemaMismatch('truncated header')
+
+        magic, version, schema, crc, size = cls.header.unpack_from(buf)
+        if magic != cls.magic or version != marshal.version:
+            raise SchemaMismatch('unknown format')
+        if schema != cls.schema:
+            raise SchemaMismatch('schema %d, expected %d' % (schema,
+                                                             cls.schema))
+
+        data = memoryview(buf)[cls.header.size:]
+        if len(data) != size or binascii.crc32(data) != crc:
+            raise SchemaMismatch('checksum mismatch')
+
+        return marshal.loads(data)
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open marshal file.
+
+        :param obj: Python object to serialize
+        :type obj: data supported by :mod:`marshal`
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        data = marshal.dumps(obj, marshal.version)
+        file_obj.write(cls.header.pack(cls.magic, marshal.version,
+                                       cls.schema, binascii.crc32(data),
+                                       len(data)))
+        file_obj.write(data)
+
+
 # Set up default manager and register built-in serializers
 manager = SerializerManager()
 manager.register('pickle', PickleSerializer)
 manager.register('json', JSONSerializer)
+manager.register('marshal', MarshalSerializer)
+
+
+class SearchKeyForm(object):
+    """One form (as-is or ASCII-folded) of a :class:`SearchKey`.
+
+    Holds the values :meth:`Workflow.filter` tests a query against.
+    Capitals, atoms and initials are only computed when a matching
+    rule first needs them.
+
+    """
+
+    __slots__ = ('text', 'lower', '_capitals', '_atoms', '_initials')
+
+    def __init__(self, text):
+        """Create new :class:`SearchKeyForm` for ``text``."""
+        self.text = text
+        self.lower = text.lower()
+        self._capitals = None
+        self._atoms = None
+        self._initials = None
+
+    @property
+    def capitals(self):
+        """Lower-cased capital letters and digits of :attr:`text`."""
+        if self._capitals is None:
+            self._capitals = ''.join(
+                [c for c in self.text if c in INITIALS]).lower()
+        return self._capitals
+
+    @property
+    def atoms(self):
+        """Lower-cased "words" of :attr:`text`."""
+        if self._atoms is None:
+            self._atoms = [s.lower() for s in split_on_delimiters(self.text)]
+        return self._atoms
+
+    @property
+    def initials(self):
+        """First characters of :attr:`atoms`."""
+        if self._initials is None:
+            self._initials = ''.join([s[0] for s in self.atoms if s])
+        return self._initials
+
+    def precompute(self):
+        """Compute all lazy values, e.g. before the form is cached."""
+        self.capitals
+        self.initials
+        return self
+
+
+class SearchKey(object):
+    """Search key of an item, with the forms :meth:`Workflow.filter` needs.
+
+    Build these once with :meth:`Workflow.search_keys`, cache them
+    alongside your data, and pass them to :meth:`Workflow.filter` as
+    ``keys`` to skip diacritic folding and lower-casing of every item
+    on every query.
+
+    :param value: the item's search key (i.e. ``key(item)``)
+    :type value: ``unicode``
+
+    """
+
+    __slots__ = ('value', '_raw', '_folded')
+
+    def __init__(self, value):
+        """Create new :class:`SearchKey` for ``value``."""
+        self.value = value.strip()
+        self._raw = None
+        self._folded = None
+
+    def form(self, fold_diacritics):
+        """Return the :class:`SearchKeyForm` to match queries against.
+
+        :param fold_diacritics: whether to return the ASCII-folded form
+        :type fold_diacritics: ``Boolean``
+
+        """
+        if fold_diacritics:
+            if self._folded is None:
+                if isascii(self.value):  # folding changes nothing
+                    self._folded = self.form(False)
+                else:
+                    self._folded = SearchKeyForm(fold_to_ascii(self.value))
+            return self._folded
+
+        if self._raw is None:
+            self._raw = SearchKeyForm(self.value)
+        return self._raw
+
+    def precompute(self):
+        """Compute both forms completely, e.g. before the key is cached."""
+        self.form(True).precompute()
+        self.form(False).precompute()
+        return self
+
+
+class SearchIndex(list):
+    """List of :class:`SearchKey` objects, packed for filtering in bulk.
+
+    Returned by :meth:`Workflow.search_keys`. When given as ``keys``,
+    :meth:`Workflow.filter` uses it to find the items that can match
+    a query across all search keys at once, and only scores those
+    in Python. The packed form is one string of the lower-cased keys,
+    joined by newlines, plus the offset of each key in it. It is built
+    on first use and cached (and pickled) with the keys.
+
+    Without :mod:`numpy`, candidates are only found for queries matched
+    on :const:`MATCH_STARTSWITH` and :const:`MATCH_SUBSTRING` (and
+    :const:`MATCH_ATOM` for ASCII-only keys), by searching the packed
+    string. If :mod:`numpy` is installed, other queries are narrowed
+    down to the items containing every character of the query.
+
+    Don't modify the list once it has been used for filtering.
+
+    :param keys: :class:`SearchKey` objects
+    :type keys: ``iterable``
+
+    """
+
+    def __init__(self, keys=()):
+        """Create new :class:`SearchIndex` of ``keys``."""
+        list.__init__(self, keys)
+        self._packed = {}
+        self._arrays = {}
+        self._digest = None
+
+    def __getstate__(self):
+        """Pickle the packed keys, but not the :mod:`numpy` arrays."""
+        return {'_packed': self._packed, '_digest': self._digest}
+
+    def __setstate__(self, state):
+        """Restore pickled packed keys."""
+        self._packed = state['_packed']
+        self._digest = state.get('_digest')
+        self._arrays = {}
+
+    @property
+    def digest(self):
+        """SHA-1 hex digest of the keys' values.
+
+        Identifies the items across processes, e.g. for
+        ``incremental`` queries of :meth:`Workflow.filter`.
+
+        """
+        if self._digest is None:
+            text = '\n'.join([key.value for key in self])
+            self._digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return self._digest
+
+    def packed(self, fold_diacritics):
+        """Return the packed lower-cased forms of the keys.
+
+        :param fold_diacritics: whether to pack the ASCII-folded forms
+        :type fold_diacritics: ``Boolean``
+        :returns: ``(text, offsets, ascii)``: the keys joined by and
+            starting with a newline, the index in ``text`` of each key
+            followed by the end of ``text`` + 1, and whether ``text``
+            is ASCII-only
+        :rtype: ``tuple``
+
+        """
+        packed = self._packed.get(fold_diacritics)
+        if packed is None:
+            lowers = [key.form(fold_diacritics).lower for key in self]
+            offsets = [1]
+            for lower in lowers:
+                offsets.append(offsets[-1] + len(lower) + 1)
+            text = '\n' + '\n'.join(lowers)
+            packed = (text, offsets, isascii(text))
+            self._packed[fold_diacritics] = packed
+        return packed
+
+    def precompute(self):
+        """Pack both forms of the keys, e.g. before the index is cached."""
+        self.packed(True)
+        self.packed(False)
+        self.digest
+        return self
+
+    def candidates(self, word):
+        """Return indices of the keys that may match :class:`QueryWord` ``word``.
+
+        :returns: ``set`` of indices, or ``None`` if every key has to
+            be tested
+
+        """
+        text, offsets, ascii = self.packed(word.fold)
+        if not word.match_on & ~MATCH_STARTSWITH:
+            return self._find(text, offsets, '\n' + word.text, 1)
+
+        # with ASCII-only keys, atoms are substrings of the keys, too
+        substring_rules = MATCH_STARTSWITH | MATCH_SUBSTRING
+        if ascii:
+            substring_rules |= MATCH_ATOM
+        if not word.match_on & ~substring_rules:
+            return self._find(text, offsets, word.text, 0)
+
+        return self._containing(word)
+
+    @staticmethod
+    def _find(text, offsets, needle, shift):
+        """Return indices of the keys containing ``needle``.
+
+        ``shift`` is the number of characters of ``needle`` before the
+        start of a key, i.e. 1 for a leading newline.
+
+        """
+        found = set()
+        find = text.find
+        pos = find(needle)
+        while pos != -1:
+            i = bisect_right(offsets, pos + shift) - 1
+            found.add(i)
+            # continue with the next key
+            pos = find(needle, offsets[i + 1] - shift)
+        return found
+
+    def _containing(self, word):
+        """Return indices of the keys containing every character of ``word``.
+
+        Requires :mod:`numpy`; returns ``None`` without it.
+
+        """
+        np = _numpy()
+        if np is None:
+            return None
+        arrays = self._arrays.get(word.fold)
+        if arrays is None:
+            text, offsets, _ = self.packed(word.fold)
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+            arrays = (codes, np.asarray(offsets[:-1], dtype=np.int64))
+            self._arrays[word.fold] = arrays
+        codes, starts = arrays
+
+        mask = None
+        for c in word.chars:
+            hits = np.zeros(len(starts), dtype=bool)
+            positions = np.flatnonzero(codes == ord(c))
+            # a newline in ``word`` also hits the separators, which only
+            # adds candidates that are then rejected
+            hits[np.searchsorted(starts, positions, side='right') - 1] = True
+            mask = hits if mask is None else mask & hits
+        return set(np.flatnonzero(mask).tolist())
+
+
+class QueryWord(object):
+    """One word of a :class:`QueryMatcher` query.
+
+    Holds everything about the word that :meth:`Workflow.filter` would
+    otherwise recompute for every item: its lower-cased text and set
+    of characters, whether search keys are folded to ASCII for it and
+    the compiled :const:`MATCH_ALLCHARS` pattern.
+
+    :param word: the word, without surrounding whitespace
+    :type word: ``unicode``
+    :param match_on: ``MATCH_*`` flags to test
+    :type match_on: ``int``
+    :param fold_diacritics: fold search keys to ASCII if ``word`` is
+        ASCII-only
+    :type fold_diacritics: ``Boolean``
+    :param search_for_query: function returning the compiled
+        :const:`MATCH_ALLCHARS` search for a lower-cased word, e.g.
+        :meth:`Workflow._search_for_query`
+
+    """
+
+    __slots__ = ('text', 'chars', 'fold', 'match_on', 'search')
+
+    def __init__(self, word, match_on, fold_diacritics, search_for_query):
+        """Create new :class:`QueryWord` for ``word``."""
+        self.text = word.lower()
+        self.chars = frozenset(self.text)
+        self.fold = fold_diacritics and isascii(self.text)
+        self.match_on = match_on
+        self.search = None
+        if match_on & MATCH_ALLCHARS:
+            self.search = search_for_query(self.text)
+
+    def match(self, key):
+        """Test :class:`SearchKey` ``key`` against this word.
+
+        :returns: ``(score, rule)``, ``(0, None)`` if nothing matched
+
+        """
+        query = self.text
+        match_on = self.match_on
+        form = key.form(self.fold)
+        value = form.text
+        lower = form.lower
+
+        # pre-filter any items that do not contain all characters
+        # of ``query`` to save on running several more expensive tests
+        for c in self.chars:
+            if c not in lower:
+                return (0, None)
+
+        # item starts with query
+        if match_on & MATCH_STARTSWITH and lower.startswith(query):
+            score = 100.0 - (len(value) / len(query))
+
+            return (score, MATCH_STARTSWITH)
+
+        # query matches capitalised letters in item,
+        # e.g. of = OmniFocus
+        if match_on & MATCH_CAPITALS:
+            initials = form.capitals
+            if initials.startswith(query):
+                score = 100.0 - (len(initials) / len(query))
+
+                return (score, MATCH_CAPITALS)
+
+        # is `query` one of the "atoms" (words separated by spaces
+        # or other non-word characters) in item? Similar to substring,
+        # but scores more highly, as it's a word within the item
+        if match_on & MATCH_ATOM and query in form.atoms:
+            score = 100.0 - (len(value) / len(query))
+
+            return (score, MATCH_ATOM)
+
+        # `query` matches start (or all) of the initials of the
+        # atoms, e.g. ``himym`` matches "How I Met Your Mother"
+        # *and* "how i met your mother" (the ``capitals`` rule only
+        # matches the former)
+        if match_on & MATCH_INITIALS_STARTSWITH:
+            initials = form.initials
+            if initials.startswith(query):
+                score = 100.0 - (len(initials) / len(query))
+
+                return (score, MATCH_INITIALS_STARTSWITH)
+
+        # `query` is a substring of initials, e.g. ``doh`` matches
+        # "The Dukes of Hazzard"
+        if match_on & MATCH_INITIALS_CONTAIN:
+            initials = form.initials
+            if query in initials:
+                score = 95.0 - (len(initials) / len(query))
+
+                return (score, MATCH_INITIALS_CONTAIN)
+
+        # `query` is a substring of item
+        if match_on & MATCH_SUBSTRING and query in lower:
+            score = 90.0 - (len(value) / len(query))
+
+            return (score, MATCH_SUBSTRING)
+
+        # finally, assign a score based on how close together the
+        # characters in `query` are in item.
+        if self.search is not None:
+            match = self.search(value)
+            if match:
+                score = 100.0 / ((1 + match.start()) *
+                                 (match.end() - match.start() + 1))
+
+                return (score, MATCH_ALLCHARS)
+
+        # Nothing matched
+        return (0, None)
+
+
+class QueryMatcher(object):
+    """Query compiled once for :meth:`Workflow.filter`.
+
+    The query is split into :class:`QueryWord` objects up front, so
+    matching an item is a loop over its words and the item's
+    :class:`SearchKey`.
+
+    :param query: query to match items against
+    :type query: ``unicode``
+    :param match_on: ``MATCH_*`` flags to test
+    :type match_on: ``int``
+    :param fold_diacritics: fold search keys to ASCII for ASCII-only
+        words of ``query``
+    :type fold_diacritics: ``Boolean``
+    :param search_for_query: function returning the compiled
+        :const:`MATCH_ALLCHARS` search for a lower-cased word
+
+    """
+
+    __slots__ = ('words',)
+
+    def __init__(self, query, match_on, fold_diacritics, search_for_query):
+        """Create new :class:`QueryMatcher` for ``query``."""
+        self.words = [QueryWord(word, match_on, fold_diacritics,
+                                search_for_query)
+                      for word in [s.strip() for s in query.split(' ')]
+                      if word]
+
+    def match(self, key):
+        """Test :class:`SearchKey` ``key`` against every word of the query.
+
+        :returns: ``(score, rule)``: the sum of the words' scores and
+            the rule that matched the last word, or ``(0, None)`` if
+            any word did not match
+
+        """
+        score = 0
+        rule = None
+        for word in self.words:
+            s, rule = word.match(key)
+            if not s:  # Skip items that don't match part of the query
+                return (0, None)
+            score += s
+        return (score, rule)
+
+    def candidates(self, index):
+        """Return indices of the items of ``index`` that may match the query.
+
+        :param index: search keys of the items
+        :type index: :class:`SearchIndex`
+        :returns: ``set`` of indices, or ``None`` if every item has to
+            be tested
+
+        """
+        found = None
+        for word in self.words:
+            hits = index.candidates(word)
+            if hits is not None:
+                found = hits if found is None else found & hits
+        return found
+
+    def narrows(self, words, match_on):
+        """Return whether this query only matches items ``words`` matched.
+
+        That is the case if this query extends the other one, e.g. as
+        the user types: the same words, except that the last one may be
+        longer and more words may follow. Every ``MATCH_*`` rule but
+        :const:`MATCH_ATOM` still matches an item if characters are
+        removed from the end of a word; an atom still matches as a
+        substring, so :const:`MATCH_ATOM` needs :const:`MATCH_SUBSTRING`.
+
+        :param words: ``(text, fold)`` of each :class:`QueryWord` of
+            the other query
+        :type words: ``list``
+        :param match_on: ``MATCH_*`` flags of both queries
+        :type match_on: ``int``
+        :returns: ``True`` if items not matching ``words`` can be skipped
+        :rtype: ``Boolean``
+
+        """
+        if not words or len(words) > len(self.words):
+            return False
+        atom = match_on & MATCH_ATOM
+        if atom and not match_on & MATCH_SUBSTRING:
+            return False
+
+        last = len(words) - 1
+        for i, (text, fold) in enumerate(words):
+            word = self.words[i]
+            if word.fold != fold:
+                return False
+            if word.text == text:
+                continue
+            if i < last or not word.text.startswith(text):
+                return False
+            # lower-casing of sigma depends on the next character, so
+            # an atom with one isn't necessarily a substring of the key
+            if atom and ('\u03c3' in word.text or '\u03c2' in word.text):
+                return False
+        return True
+
+    def exact_score(self):
+        """Return the best score :const:`MATCH_STARTSWITH` can give.
+
+        That is the score of a search key equal to the longest word
+        of the query.
+
+        :returns: the score or ``None`` if no search key can start with
+            every word of the query
+
+        """
+        if not self.words:
+            return None
+        longest = max([word.text for word in self.words], key=len)
+        score = 0
+        for word in self.words:
+            if not longest.startswith(word.text):
+                return None
+            score += 100.0 - (len(longest) / len(word.text))
+        return score
 
 
 class Item(object):
@@ -872,6 +1511,151 @@ class Settings(dict):
         return ret
 
 
+class CacheBundle(object):
+    """A group of cache entries stored together in one file.
+
+    The file is read once, on first access, and the entries are then
+    kept in memory for the rest of the process. Use this for small
+    values that are always needed together, so reading them costs
+    one ``open`` and one deserialization instead of one per entry.
+
+    An appropriate instance is returned by :meth:`Workflow.cache_bundle`.
+
+    :param wf: :class:`Workflow` whose cache directory to use
+    :param name: name of the bundle (and its cache file)
+    :type name: ``unicode``
+    :param serializer: name of serializer to use. If no serializer
+        is specified, :attr:`Workflow.cache_serializer` is used.
+
+    """
+
+    def __init__(self, wf, name, serializer=None):
+        """Create new :class:`CacheBundle` object."""
+        self._wf = wf
+        self.name = name
+        self._serializer_name, self._serializer = \
+            wf._resolve_cache_serializer(serializer)
+        self._path = wf.cachefile('%s.%s' % (name, self._serializer_name))
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self):
+        """Mapping of entry name to ``(timestamp, data)``."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries
+
+    def _load(self):
+        """Read entries from the bundle file."""
+        if not os.path.exists(self._path):
+            return {}
+
+        with open(self._path, 'rb') as file_obj:
+            self._wf.logger.debug('loading cache bundle: %s', self._path)
+            try:
+                return self._serializer.load(file_obj)
+            except SchemaMismatch as err:
+                self._wf.logger.debug('ignoring cache bundle %s: %s',
+                                      self._path, err)
+                return {}
+
+    def age(self, key):
+        """Return age in seconds of entry ``key`` or 0 if it doesn't exist.
+
+        :param key: name of entry
+        :type key: ``unicode``
+        :returns: age of entry in seconds
+        :rtype: ``int``
+
+        """
+        if key not in self.entries:
+            return 0
+        return time.time() - self.entries[key][0]
+
+    def ages(self):
+        """Return mapping of entry name to age in seconds."""
+        return {key: self.age(key) for key in self.entries}
+
+    def get(self, key, data_func=None, max_age=60,
+            stale_while_revalidate=False):
+        """Return entry ``key`` if younger than ``max_age`` seconds.
+
+        Same semantics as :meth:`Workflow.cached_data`: stale or missing
+        entries are re-generated with ``data_func`` and saved.
+
+        :param key: name of entry
+        :param data_func: function to (re-)generate data.
+        :type data_func: ``callable``
+        :param max_age: maximum age of entry in seconds. If 0, return
+            the entry no matter how old.
+        :type max_age: ``int``
+        :param stale_while_revalidate: return a stale entry and
+            re-generate it in the background. See
+            :meth:`Workflow.cached_data`.
+        :type stale_while_revalidate: ``bool``
+        :returns: entry data, return value of ``data_func`` or ``None``
+            if ``data_func`` is not set
+
+        """
+        age = self.age(key)
+        if key in self.entries and (age < max_age or max_age == 0):
+            return self.entries[key][1]
+
+        if key in self.entries and stale_while_revalidate and data_func:
+            from .revalidate import revalidate
+            if revalidate(key, data_func, self._serializer_name,
+                          bundle=self.name):
+                self._wf.logger.debug('serving stale entry %s/%s',
+                                      self.name, key)
+                return self.entries[key][1]
+
+        if not data_func:
+            return None
+
+        data = data_func()
+        self.set(key, data)
+
+        return data
+
+    def set(self, key, data):
+        """Save ``data`` as entry ``key``, rewriting the bundle file.
+
+        If ``data`` is ``None``, the entry is removed. The file is
+        re-read under a lock first, so entries other processes saved
+        in the meantime are kept (and picked up). If the lock can't be
+        acquired, only this process's entries are updated.
+
+        """
+        def update(entries):
+            if data is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = (time.time(), data)
+            return entries
+
+        with self._lock:
+            try:
+                with LockFile(self._path, 0.5):
+                    entries = update(self._load())
+                    with self._serializer.atomic_writer(self._path,
+                                                        'w') as file_obj:
+                        self._serializer.dump(entries, file_obj)
+            except AcquisitionError:
+                # e.g. a revalidate job holding it: don't fail the caller
+                self._wf.logger.warning('could not lock cache bundle: %s',
+                                        self._path)
+                if self._entries is None:
+                    self._entries = self._load()
+                update(self._entries)
+                return
+
+            self._entries = entries
+
+        self._wf.logger.debug('cached bundle entry: %s/%s', self.name, key)
+
+
 class Workflow(object):
     """The ``Workflow`` object is the main interface to Alfred-Workflow.
 
@@ -922,6 +1706,15 @@ class Workflow(object):
     # won't want to change this
     item_class = Item
 
+    #: Maximum number of deserialized caches :meth:`cached_data` keeps
+    #: in memory. Set to 0 to always read caches from disk.
+    memory_cache_size = DEFAULT_MEMORY_CACHE_SIZE
+
+    #: How long (in seconds) :meth:`cached_data` waits for another process
+    #: that is re-generating the same cache, if there is no stale data to
+    #: return instead. Set to 0 to never wait.
+    cache_lock_timeout = DEFAULT_CACHE_LOCK_TIMEOUT
+
     def __init__(self, default_settings=None, update_settings=None,
                  input_encoding='utf-8', normalization='NFC',
                  capture_args=True, libraries=None,
@@ -955,6 +1748,16 @@ class Workflow(object):
         self._last_version_run = UNSET
         # Cache for regex patterns created for filter keys
         self._search_pattern_cache = {}
+        # Cache bundles loaded in this process
+        self._cache_bundles = {}
+        # In-memory LRU of deserialized caches, in front of the cache
+        # files: ``(name, serializer) -> (mtime, data)``
+        self._memory_cache = OrderedDict()
+        self._memory_cache_lock = threading.Lock()
+        self.memory_cache_stats = {'hits': 0, 'misses': 0}
+        # Contents of the cache manifest, read on first use
+        self._cache_manifest = None
+        self._cache_manifest_lock = threading.Lock()
         #: Prefix for all magic arguments.
         #: The default value is ``workflow:`` so keyword
         #: ``config`` would match user query ``workflow:config``.
@@ -1666,42 +2469,117 @@ class Workflow(object):
 
         self.logger.debug('saved data: %s', data_path)
 
-    def cached_data(self, name, data_func=None, max_age=60):
+    def _resolve_cache_serializer(self, serializer_name=None):
+        """Return ``(name, serializer)`` for ``serializer_name``.
+
+        Falls back to :attr:`cache_serializer` if ``serializer_name``
+        is ``None``. Raises a :class:`ValueError` if the serializer
+        isn't registered.
+
+        """
+        serializer_name = serializer_name or self.cache_serializer
+        serializer = manager.serializer(serializer_name)
+
+        if serializer is None:
+            raise ValueError(
+                'Invalid serializer `{0}`. Register your serializer with '
+                '`manager.register()` first.'.format(serializer_name))
+
+        return serializer_name, serializer
+
+    def cached_data(self, name, data_func=None, max_age=60, serializer=None,
+                    stale_while_revalidate=False):
         """Return cached data if younger than ``max_age`` seconds.
 
         Retrieve data from cache or re-generate and re-cache data if
         stale/non-existant. If ``max_age`` is 0, return cached data no
         matter how old.
 
+        With ``stale_while_revalidate=True``, stale data are returned
+        immediately and ``data_func`` is run by a background job
+        (see :mod:`workflow.revalidate`), so only a missing cache
+        blocks. ``data_func`` must be a module-level function for this;
+        other callables are run in the foreground as usual.
+
+        Only one process at a time re-generates a cache: the others
+        return the stale data if there are any, or wait up to
+        :attr:`cache_lock_timeout` seconds for the new data.
+
         :param name: name of datastore
         :param data_func: function to (re-)generate data.
         :type data_func: ``callable``
         :param max_age: maximum age of cached data in seconds
         :type max_age: ``int``
+        :param serializer: name of serializer to use. If no serializer
+            is specified, :attr:`cache_serializer` is used.
+        :param stale_while_revalidate: return stale data and re-generate
+            them in the background
+        :type stale_while_revalidate: ``bool``
         :returns: cached data, return value of ``data_func`` or ``None``
             if ``data_func`` is not set
 
         """
-        serializer = manager.serializer(self.cache_serializer)
-
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
-        age = self.cached_data_age(name)
-
-        if (age < max_age or max_age == 0) and os.path.exists(cache_path):
-
-            with open(cache_path, 'rb') as file_obj:
-                self.logger.debug('loading cached data: %s', cache_path)
-                return serializer.load(file_obj)
+        serializer_name, serializer = self._resolve_cache_serializer(serializer)
+
+        cache_path = self.cachefile('%s.%s' % (name, serializer_name))
+        mtime = self._cache_file_mtime(cache_path, serializer_name, serializer)
+
+        if mtime is not None and (time.time() - mtime < max_age or
+                                  max_age == 0):
+            data = self._load_cached_data(name, serializer_name, serializer,
+                                          cache_path, mtime)
+            if data is not UNSET:
+                return data
+            mtime = None  # unreadable, same as no cache
+
+        if mtime is not None and stale_while_revalidate and data_func:
+            from .revalidate import revalidate
+            if revalidate(name, data_func, serializer_name):
+                self.logger.debug('serving stale cache: %s', cache_path)
+                data = self._load_cached_data(name, serializer_name,
+                                              serializer, cache_path, mtime)
+                if data is not UNSET:
+                    return data
 
         if not data_func:
             return None
 
-        data = data_func()
-        self.cache_data(name, data)
+        lock = LockFile(cache_path, timeout=self.cache_lock_timeout)
+        if not lock.acquire(blocking=False):
+            # another process is already re-generating the data
+            if mtime is not None:
+                self.logger.debug('cache locked, serving stale data: %s',
+                                  cache_path)
+                data = self._load_cached_data(name, serializer_name,
+                                              serializer, cache_path, mtime)
+                if data is not UNSET:
+                    return data
+
+            if self.cache_lock_timeout > 0:
+                try:
+                    lock.acquire()
+                except AcquisitionError:
+                    self.logger.warning('timed out waiting for lock on '
+                                        'cache: %s', cache_path)
+
+        # the data may have been re-generated while we checked the lock
+        new_mtime = self._cache_mtime(cache_path)
+        if new_mtime is not None and new_mtime != mtime:
+            data = self._load_cached_data(name, serializer_name, serializer,
+                                          cache_path, new_mtime)
+            if data is not UNSET:
+                lock.release()
+                return data
+
+        try:
+            data = data_func()
+            self.cache_data(name, data, serializer_name)
+        finally:
+            lock.release()
 
         return data
 
-    def cache_data(self, name, data):
+    def cache_data(self, name, data, serializer=None):
         """Save ``data`` to cache under ``name``.
 
         If ``data`` is ``None``, the corresponding cache file will be
@@ -1710,59 +2588,294 @@ class Workflow(object):
         :param name: name of datastore
         :param data: data to store. This may be any object supported by
                 the cache serializer
+        :param serializer: name of serializer to use. If no serializer
+            is specified, :attr:`cache_serializer` is used.
 
         """
-        serializer = manager.serializer(self.cache_serializer)
+        serializer_name, serializer = self._resolve_cache_serializer(serializer)
+
+        cache_path = self.cachefile('%s.%s' % (name, serializer_name))
 
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        with self._memory_cache_lock:
+            self._memory_cache.pop((name, serializer_name), None)
 
         if data is None:
             if os.path.exists(cache_path):
                 os.unlink(cache_path)
                 self.logger.debug('deleted cache file: %s', cache_path)
+            self._update_cache_manifest({os.path.basename(cache_path): None})
             return
 
         with serializer.atomic_writer(cache_path, 'w') as file_obj:
             serializer.dump(data, file_obj)
 
+        self._update_cache_manifest({
+            os.path.basename(cache_path): self._manifest_entry(
+                os.stat(cache_path), serializer_name, serializer)})
+
         self.logger.debug('cached data: %s', cache_path)
 
-    def cached_data_fresh(self, name, max_age):
+    def touch_cached_data(self, name, serializer=None):
+        """Mark cache ``name`` as fresh without rewriting it.
+
+        Sets the file's modification time to now, e.g. after checking
+        that the cached data are still up to date.
+
+        :param name: name of datastore
+        :param serializer: name of serializer the cache was saved with
+        :returns: ``True`` if the cache exists, else ``False``
+        :rtype: ``bool``
+
+        """
+        serializer_name, serializer = self._resolve_cache_serializer(serializer)
+        cache_path = self.cachefile('%s.%s' % (name, serializer_name))
+
+        try:
+            os.utime(cache_path)
+            st = os.stat(cache_path)
+        except OSError:
+            self._update_cache_manifest({os.path.basename(cache_path): None})
+            return False
+
+        self._update_cache_manifest({
+            os.path.basename(cache_path): self._manifest_entry(
+                st, serializer_name, serializer)})
+        return True
+
+    def cache_bundle(self, name, serializer=None):
+        """Return the :class:`CacheBundle` called ``name``.
+
+        The bundle's file is read at most once per process; later calls
+        return the same object.
+
+        :param name: name of the bundle
+        :param serializer: name of serializer to use. If no serializer
+            is specified, :attr:`cache_serializer` is used.
+        :returns: :class:`CacheBundle`
+
+        """
+        if name not in self._cache_bundles:
+            self._cache_bundles[name] = CacheBundle(self, name, serializer)
+        return self._cache_bundles[name]
+
+    def cached_data_fresh(self, name, max_age, serializer=None):
         """Whether cache `name` is less than `max_age` seconds old.
 
         :param name: name of datastore
         :param max_age: maximum age of data in seconds
         :type max_age: ``int``
+        :param serializer: name of serializer the cache was saved with
         :returns: ``True`` if data is less than ``max_age`` old, else
             ``False``
 
         """
-        age = self.cached_data_age(name)
+        age = self.cached_data_age(name, serializer)
 
         if not age:
             return False
 
         return age < max_age
 
-    def cached_data_age(self, name):
+    def cached_data_age(self, name, serializer=None):
         """Return age in seconds of cache `name` or 0 if cache doesn't exist.
 
         :param name: name of datastore
         :type name: ``unicode``
+        :param serializer: name of serializer the cache was saved with
         :returns: age of datastore in seconds
         :rtype: ``int``
 
         """
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        serializer_name = serializer or self.cache_serializer
+        cache_path = self.cachefile('%s.%s' % (name, serializer_name))
+        mtime = self._cache_file_mtime(cache_path, serializer_name,
+                                       manager.serializer(serializer_name))
 
-        if not os.path.exists(cache_path):
+        if mtime is None:
             return 0
 
-        return time.time() - os.stat(cache_path).st_mtime
+        return time.time() - mtime
+
+    def _cache_mtime(self, cache_path):
+        """Return mtime of ``cache_path`` or ``None`` if it doesn't exist."""
+        try:
+            return os.stat(cache_path).st_mtime
+        except OSError:
+            return None
+
+    def _cache_file_mtime(self, cache_path, serializer_name, serializer):
+        """Return mtime of a cache file as recorded in the cache manifest.
+
+        Files missing from the manifest (e.g. written by an older
+        version or by hand) are looked up with :func:`os.stat` and
+        added to it. Files recorded with a different serializer schema
+        count as missing.
+
+        :returns: mtime or ``None`` if the file doesn't exist
+            or has the wrong schema
+
+        """
+        filename = os.path.basename(cache_path)
+        manifest = self._read_cache_manifest()
+        entry = manifest.get(filename)
+
+        if entry is None:
+            try:
+                st = os.stat(cache_path)
+            except OSError:
+                return None
+            entry = self._manifest_entry(st, serializer_name, serializer)
+            manifest[filename] = entry
+
+        if entry['schema'] != getattr(serializer, 'schema', None):
+            return None
+
+        return entry['mtime']
+
+    def _manifest_entry(self, st, serializer_name, serializer):
+        """Return cache manifest entry for ``os.stat`` result ``st``."""
+        return {'mtime': st.st_mtime, 'size': st.st_size,
+                'serializer': serializer_name,
+                'schema': getattr(serializer, 'schema', None)}
+
+    def _read_cache_manifest(self):
+        """Return the cache manifest, reading it on first use.
+
+        Maps cache filenames to their ``mtime``, ``size``,
+        ``serializer`` and ``schema``. The file is only read once per
+        process, so checking the age of a cache is a dict lookup.
+
+        """
+        with self._cache_manifest_lock:
+            if self._cache_manifest is None:
+                self._cache_manifest = self._load_cache_manifest()
+            return self._cache_manifest
+
+    def _load_cache_manifest(self):
+        """Load cache manifest from disk. Return ``{}`` if it's unreadable."""
+        try:
+            with open(self.cachefile(CACHE_MANIFEST), 'rb') as file_obj:
+                manifest = json.load(file_obj)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(manifest, dict):
+            return {}
+
+        return manifest
+
+    def _update_cache_manifest(self, changes):
+        """Apply ``changes`` to the cache manifest and save it.
+
+        The manifest on disk is re-read under a lock, so entries written
+        by other processes meanwhile are kept. If the lock can't be
+        acquired, only this process's copy is updated.
+
+        :param changes: mapping of cache filename to new entry or
+            ``None`` to remove the entry
+        :type changes: ``dict``
+
+        """
+        manifest_path = self.cachefile(CACHE_MANIFEST)
+        try:
+            with LockFile(manifest_path, 0.5):
+                manifest = self._load_cache_manifest()
+                for filename, entry in changes.items():
+                    if entry is None:
+                        manifest.pop(filename, None)
+                    else:
+                        manifest[filename] = entry
+
+                with atomic_writer(manifest_path, 'w') as file_obj:
+                    json.dump(manifest, file_obj)
+        except AcquisitionError:
+            # readers notice the changed files when they open them
+            self.logger.warning('could not lock cache manifest')
+
+        with self._cache_manifest_lock:
+            if self._cache_manifest is not None:
+                for filename, entry in changes.items():
+                    if entry is None:
+                        self._cache_manifest.pop(filename, None)
+                    else:
+                        self._cache_manifest[filename] = entry
+
+    def _load_cached_data(self, name, serializer_name, serializer,
+                          cache_path, mtime):
+        """Load cache file, from the in-memory cache if it's unchanged.
+
+        Entries of the in-memory cache are keyed by name and serializer
+        and only used while the file's mtime matches, so changes made
+        by other processes are picked up. Data is returned as-is, not
+        copied: don't modify it.
+
+        Returns :const:`UNSET` if the serializer rejects the file with
+        :class:`SchemaMismatch`.
+
+        """
+        key = (name, serializer_name)
+        with self._memory_cache_lock:
+            entry = self._memory_cache.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._memory_cache.move_to_end(key)
+                self.memory_cache_stats['hits'] += 1
+                return entry[1]
+            self.memory_cache_stats['misses'] += 1
+
+        try:
+            file_obj = open(cache_path, 'rb')
+        except FileNotFoundError:
+            # deleted behind the manifest's back
+            self.logger.debug('cache file gone: %s', cache_path)
+            self._update_cache_manifest({os.path.basename(cache_path): None})
+            return UNSET
+
+        with file_obj:
+            self.logger.debug('loading cached data: %s', cache_path)
+            st = os.fstat(file_obj.fileno())
+            if st.st_mtime != mtime:
+                # rewritten behind the manifest's back
+                self._update_cache_manifest({
+                    os.path.basename(cache_path): self._manifest_entry(
+                        st, serializer_name, serializer)})
+                mtime = st.st_mtime
+            try:
+                data = serializer.load(file_obj)
+            except SchemaMismatch as err:
+                self.logger.debug('ignoring cache %s: %s', cache_path, err)
+                return UNSET
+
+        if self.memory_cache_size:
+            with self._memory_cache_lock:
+                self._memory_cache[key] = (mtime, data)
+                self._memory_cache.move_to_end(key)
+                while len(self._memory_cache) > self.memory_cache_size:
+                    self._memory_cache.popitem(last=False)
+
+        return data
+
+    def search_keys(self, items, key=lambda x: x):
+        """Return precomputed :class:`SearchKey` objects for ``items``.
+
+        Cache the result together with ``items`` and pass it to
+        :meth:`filter` as ``keys``, so diacritic folding, lower-casing
+        and splitting into atoms happen once instead of on every query.
+
+        :param items: iterable of items
+        :param key: function to get comparison key from ``items``, as
+            for :meth:`filter`
+        :type key: ``callable``
+        :returns: one :class:`SearchKey` per item
+        :rtype: :class:`SearchIndex`
+
+        """
+        return SearchIndex(SearchKey(key(item)).precompute()
+                           for item in items).precompute()
 
     def filter(self, query, items, key=lambda x: x, ascending=False,
                include_score=False, min_score=0, max_results=0,
-               match_on=MATCH_ALL, fold_diacritics=True):
+               match_on=MATCH_ALL, fold_diacritics=True, keys=None,
+               stop_at_exact=False, incremental=None):
         """Fuzzy search filter. Returns list of ``items`` that match ``query``.
 
         ``query`` is case-insensitive. Any item that does not contain the
@@ -1789,6 +2902,8 @@ class Workflow(object):
             than this.
         :type min_score: ``int``
         :param max_results: If non-zero, prune results list to this length.
+            Only the best ``max_results`` matches are kept while sorting,
+            instead of sorting all of them.
         :type max_results: ``int``
         :param match_on: Filter option flags. Bitwise-combined list of
             ``MATCH_*`` constants (see below).
@@ -1796,6 +2911,28 @@ class Workflow(object):
         :param fold_diacritics: Convert search keys to ASCII-only
             characters if ``query`` only contains ASCII characters.
         :type fold_diacritics: ``Boolean``
+        :param keys: :class:`SearchKey` objects for ``items``, in the
+            same order, as returned by :meth:`search_keys`. If given,
+            ``key`` is not called. If ``keys`` is a :class:`SearchIndex`,
+            only the items it can't rule out are tested, and ``items``
+            must be a sequence.
+        :type keys: ``list``
+        :param stop_at_exact: If ``True``, ``max_results`` is set and
+            ``match_on`` is :const:`MATCH_STARTSWITH`, stop testing
+            items once ``max_results`` items with the best possible
+            score (i.e. a search key equal to ``query``) have been found.
+            Ignored if ``ascending`` is ``True``. Among such items, the
+            first ones found are returned, not the first ones in sort
+            order.
+        :type stop_at_exact: ``Boolean``
+        :param incremental: Name to remember which items matched
+            ``query`` under for :const:`FILTER_STATE_MAX_AGE` seconds.
+            If a later call with the same name, ``match_on`` and items
+            extends that query (e.g. ``swe`` after ``sw``), only those
+            items are tested. Requires ``keys`` to be a
+            :class:`SearchIndex`, and only applies to queries it can't
+            narrow down by itself (see :class:`SearchIndex`).
+        :type incremental: ``unicode``
         :returns: list of ``items`` matching ``query`` or list of
             ``(item, score, rule)`` `tuples` if ``include_score`` is ``True``.
             ``rule`` is the ``MATCH_*`` rule that matched the item.
@@ -1874,44 +3011,74 @@ class Workflow(object):
         fold_diacritics = self.settings.get('__workflow_diacritic_folding',
                                             fold_diacritics)
 
+        matcher = QueryMatcher(query, match_on, fold_diacritics,
+                               self._search_for_query)
+        match = matcher.match
         results = []
 
-        for item in items:
-            skip = False
-            score = 0
-            words = [s.strip() for s in query.split(' ')]
-            value = key(item).strip()
-            if value == '':
+        # no later item can beat ``max_results`` exact matches
+        exact = None
+        if (stop_at_exact and max_results and not ascending and
+                match_on == MATCH_STARTSWITH):
+            exact = matcher.exact_score()
+        found = 0
+
+        # only score the items a packed index can't rule out or, if it
+        # can't narrow the query down, that matched the query this one
+        # extends (keeping state costs more than searching the index)
+        candidates = None
+        survivors = None
+        if isinstance(keys, SearchIndex):
+            candidates = matcher.candidates(keys)
+            if candidates is None and incremental:
+                candidates = self._filter_state(incremental, keys, matcher,
+                                                match_on)
+                survivors = []
+
+        if keys is None:
+            triples = ((None, item, SearchKey(key(item))) for item in items)
+        elif candidates is None:
+            triples = zip(range(len(keys)), items, keys)
+        else:
+            triples = [(i, items[i], keys[i]) for i in sorted(candidates)]
+
+        for i, item, value in triples:
+            if value.value == '':
                 continue
-            for word in words:
-                if word == '':
-                    continue
-                s, rule = self._filter_item(value, word, match_on,
-                                            fold_diacritics)
 
-                if not s:  # Skip items that don't match part of the query
-                    skip = True
-                score += s
+            score, rule = match(value)
 
-            if skip:
-                continue
+            if rule is not None and survivors is not None:
+                survivors.append(i)
 
-            if score:
+            if score and (not min_score or score > min_score):
                 # use "reversed" `score` (i.e. highest becomes lowest) and
                 # `value` as sort key. This means items with the same score
                 # will be sorted in alphabetical not reverse alphabetical order
-                results.append(((100.0 / score, value.lower(), score),
+                results.append(((100.0 / score, value.value.lower(), score),
                                 (item, score, rule)))
 
-        # sort on keys, then discard the keys
-        results.sort(reverse=ascending)
-        results = [t[1] for t in results]
+                if exact is not None and score >= exact:
+                    found += 1
+                    if found == max_results:
+                        survivors = None  # not every item was tested
+                        break
 
-        if min_score:
-            results = [r for r in results if r[1] > min_score]
+        if survivors is not None:
+            self._save_filter_state(incremental, keys, matcher, match_on,
+                                    survivors)
 
+        # sort on keys, then discard the keys
         if max_results and len(results) > max_results:
-            results = results[:max_results]
+            # bounded heap, same order as
+            # ``sorted(results, reverse=ascending)[:max_results]``
+            if ascending:
+                results = heapq.nlargest(max_results, results)
+            else:
+                results = heapq.nsmallest(max_results, results)
+        else:
+            results.sort(reverse=ascending)
+        results = [t[1] for t in results]
 
         # return list of ``(item, score, rule)``
         if include_score:
@@ -1919,98 +3086,52 @@ class Workflow(object):
         # just return list of items
         return [t[0] for t in results]
 
-    def _filter_item(self, value, query, match_on, fold_diacritics):
-        """Filter ``value`` against ``query`` using rules ``match_on``.
+    def _filter_state_name(self, name):
+        """Return cache name of ``incremental`` filter state ``name``."""
+        return '__workflow_filter_{0}'.format(name)
 
-        :returns: ``(score, rule)``
+    def _filter_state(self, name, keys, matcher, match_on):
+        """Return indices of the items the last ``name`` query matched.
 
-        """
-        query = query.lower()
-
-        if not isascii(query):
-            fold_diacritics = False
-
-        if fold_diacritics:
-            value = self.fold_to_ascii(value)
-
-        # pre-filter any items that do not contain all characters
-        # of ``query`` to save on running several more expensive tests
-        if not set(query) <= set(value.lower()):
-
-            return (0, None)
-
-        # item starts with query
-        # print(match_on & MATCH_STARTSWITH, value.lower().startswith(query), value.lower(), query)
-        if match_on & MATCH_STARTSWITH and value.lower().startswith(query):
-            score = 100.0 - (len(value) / len(query))
-
-            return (score, MATCH_STARTSWITH)
-
-        # query matches capitalised letters in item,
-        # e.g. of = OmniFocus
-        if match_on & MATCH_CAPITALS:
-            initials = ''.join([c for c in value if c in INITIALS])
-            if initials.lower().startswith(query):
-                score = 100.0 - (len(initials) / len(query))
-
-                return (score, MATCH_CAPITALS)
-
-        # split the item into "atoms", i.e. words separated by
-        # spaces or other non-word characters
-        if (match_on & MATCH_ATOM or
-                match_on & MATCH_INITIALS_CONTAIN or
-                match_on & MATCH_INITIALS_STARTSWITH):
-            atoms = [s.lower() for s in split_on_delimiters(value)]
-            # print('atoms : %s  -->  %s' % (value, atoms))
-            # initials of the atoms
-            initials = ''.join([s[0] for s in atoms if s])
-
-        if match_on & MATCH_ATOM:
-            # is `query` one of the atoms in item?
-            # similar to substring, but scores more highly, as it's
-            # a word within the item
-            if query in atoms:
-                score = 100.0 - (len(value) / len(query))
-
-                return (score, MATCH_ATOM)
-
-        # `query` matches start (or all) of the initials of the
-        # atoms, e.g. ``himym`` matches "How I Met Your Mother"
-        # *and* "how i met your mother" (the ``capitals`` rule only
-        # matches the former)
-        if (match_on & MATCH_INITIALS_STARTSWITH and
-                initials.startswith(query)):
-            score = 100.0 - (len(initials) / len(query))
-
-            return (score, MATCH_INITIALS_STARTSWITH)
+        :returns: ``set`` of indices into ``keys``, or ``None`` if there
+            is no such query or ``matcher`` doesn't extend it
 
-        # `query` is a substring of initials, e.g. ``doh`` matches
-        # "The Dukes of Hazzard"
-        elif (match_on & MATCH_INITIALS_CONTAIN and
-                query in initials):
-            score = 95.0 - (len(initials) / len(query))
+        """
+        state = self.cached_data(self._filter_state_name(name),
+                                 max_age=FILTER_STATE_MAX_AGE,
+                                 serializer='marshal')
+        if (not state or state['digest'] != keys.digest or
+                state['match_on'] != match_on or
+                not matcher.narrows(state['words'], match_on)):
+            return None
 
-            return (score, MATCH_INITIALS_CONTAIN)
+        self.logger.debug('filter %r: testing %d of %d items', name,
+                          len(state['survivors']), len(keys))
+        return set(state['survivors'])
+
+    def _save_filter_state(self, name, keys, matcher, match_on, survivors):
+        """Remember which ``keys`` matched the ``name`` query."""
+        state = {
+            'digest': keys.digest,
+            'match_on': match_on,
+            'words': [(word.text, word.fold) for word in matcher.words],
+            'survivors': survivors,
+        }
+        self.cache_data(self._filter_state_name(name), state,
+                        serializer='marshal')
 
-        # `query` is a substring of item
-        if match_on & MATCH_SUBSTRING and query in value.lower():
-            score = 90.0 - (len(value) / len(query))
+    def _filter_item(self, value, query, match_on, fold_diacritics):
+        """Filter ``value`` against ``query`` using rules ``match_on``.
 
-            return (score, MATCH_SUBSTRING)
+        ``value`` may be a string or a :class:`SearchKey`.
 
-        # finally, assign a score based on how close together the
-        # characters in `query` are in item.
-        if match_on & MATCH_ALLCHARS:
-            search = self._search_for_query(query)
-            match = search(value)
-            if match:
-                score = 100.0 / ((1 + match.start()) *
-                                 (match.end() - match.start() + 1))
-
-                return (score, MATCH_ALLCHARS)
+        :returns: ``(score, rule)``
 
-        # Nothing matched
-        return (0, None)
+        """
+        if not isinstance(value, SearchKey):
+            value = SearchKey(value)
+        return QueryWord(query, match_on, fold_diacritics,
+                         self._search_for_query).match(value)
 
     def _search_for_query(self, query):
         if query in self._search_pattern_cache:
@@ -2098,6 +3219,10 @@ class Workflow(object):
             return 1
 
         finally:
+            if any(self.memory_cache_stats.values()):
+                self.logger.debug('memory cache: %d hits, %d misses',
+                                  self.memory_cache_stats['hits'],
+                                  self.memory_cache_stats['misses'])
             self.logger.debug('---------- finished in %0.3fs ----------',
                               time.time() - start)
 
@@ -2602,6 +3727,15 @@ class Workflow(object):
         :type filter_func: ``callable``
         """
         self._delete_directory_contents(self.cachedir, filter_func)
+        self._cache_bundles = {}
+        with self._memory_cache_lock:
+            self._memory_cache.clear()
+        with self._cache_manifest_lock:
+            self._cache_manifest = None
+        if os.path.exists(self.cachefile(CACHE_MANIFEST)):
+            self._update_cache_manifest({
+                filename: None for filename in self._load_cache_manifest()
+                if filter_func(filename)})
 
     def clear_data(self, filter_func=lambda f: True):
         """Delete all files in workflow's :attr:`datadir`.
@@ -2709,10 +3843,7 @@ class Workflow(object):
         :rtype: ``unicode``
 
         """
-        if isascii(text):
-            return text
-        text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
-        return unicodedata.normalize('NFKD', text)
+        return fold_to_ascii(text)
 
     def dumbify_punctuation(self, text):
         """Convert non-ASCII punctuation to closest ASCII equivalent.
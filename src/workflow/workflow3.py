@@ -599,7 +599,12 @@ class Workflow3(Workflow):
         """New cache name/key based on session ID."""
         return self._session_prefix + name
 
-    def cache_data(self, name, data, session=False):
+    def _filter_state_name(self, name):
+        """Scope ``incremental`` :meth:`filter` state to the session."""
+        return self._mk_session_name(
+            super(Workflow3, self)._filter_state_name(name))
+
+    def cache_data(self, name, data, session=False, serializer=None):
         """Cache API with session-scoped expiry.
 
         .. versionadded:: 1.25
@@ -609,6 +614,7 @@ class Workflow3(Workflow):
             data (object): Data to cache
             session (bool, optional): Whether to scope the cache
                 to the current session.
+            serializer (str, optional): Name of serializer to use.
 
         ``name`` and ``data`` are the same as for the
         :meth:`~workflow.Workflow.cache_data` method on
@@ -621,9 +627,10 @@ class Workflow3(Workflow):
         if session:
             name = self._mk_session_name(name)
 
-        return super(Workflow3, self).cache_data(name, data)
+        return super(Workflow3, self).cache_data(name, data, serializer)
 
-    def cached_data(self, name, data_func=None, max_age=60, session=False):
+    def cached_data(self, name, data_func=None, max_age=60, session=False,
+                    serializer=None, stale_while_revalidate=False):
         """Cache API with session-scoped expiry.
 
         .. versionadded:: 1.25
@@ -635,6 +642,9 @@ class Workflow3(Workflow):
             max_age (int): Maximum allowable age of cache in seconds.
             session (bool, optional): Whether to scope the cache
                 to the current session.
+            serializer (str, optional): Name of serializer to use.
+            stale_while_revalidate (bool, optional): Return expired
+                data and re-generate them in the background.
 
         ``name``, ``data_func`` and ``max_age`` are the same as for the
         :meth:`~workflow.Workflow.cached_data` method on
@@ -647,7 +657,9 @@ class Workflow3(Workflow):
         if session:
             name = self._mk_session_name(name)
 
-        return super(Workflow3, self).cached_data(name, data_func, max_age)
+        return super(Workflow3, self).cached_data(name, data_func, max_age,
+                                                  serializer,
+                                                  stale_while_revalidate)
 
     def clear_session_cache(self, current=False):
         """Remove session data from the cache.
@@ -0,0 +1,57 @@
+# python 3
+# encoding: utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# the workflow's modules import each other from src, like Alfred runs them
+sys.path.insert(0, SRC)
+
+# logs every invocation to $FAKE_MULLVAD_LOG, then runs the test's script; state files go in $FAKE_MULLVAD_DIR
+FAKE_MULLVAD = '''#!/bin/sh
+echo "$*" >> "$FAKE_MULLVAD_LOG"
+{script}
+'''
+
+
+@pytest.fixture
+def fake_mullvad(tmp_path):
+    """ Factory installing a fake `mullvad` CLI made of a shell script
+    Returns:
+    Function taking the script and returning the environment to run the workflow's scripts with (cwd=SRC)
+    """
+    # the broker's socket lives in $TMPDIR, and AF_UNIX paths are too short for pytest's tmp_path on macOS
+    tmpdir = tempfile.mkdtemp(prefix='mv')
+
+    def install(script):
+        binary = tmp_path / 'mullvad'
+        binary.write_text(FAKE_MULLVAD.format(script=script))
+        binary.chmod(0o755)
+        env = dict(os.environ,
+                   mullvad_bin=str(binary),
+                   FAKE_MULLVAD_LOG=str(tmp_path / 'mullvad.log'),
+                   FAKE_MULLVAD_DIR=str(tmp_path),
+                   TMPDIR=tmpdir,
+                   alfred_workflow_bundleid='net.test.mullvad',
+                   alfred_workflow_cache=str(tmp_path / 'cache'),
+                   alfred_workflow_data=str(tmp_path / 'data'))
+        env.pop('PYTHONPATH', None)
+        return env
+
+    yield install
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def invocations(env):
+    """ Command lines the fake `mullvad` was run with, in order """
+    try:
+        with open(env['FAKE_MULLVAD_LOG']) as fp:
+            return fp.read().splitlines()
+    except FileNotFoundError:
+        return []
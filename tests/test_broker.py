@@ -0,0 +1,77 @@
+# python 3
+# encoding: utf-8
+
+import os
+import sys
+import time
+import subprocess
+from collections import Counter
+
+import pytest
+
+from conftest import SRC, invocations
+
+# slower than BROKER_TIMEOUT, so a client giving up on the broker would run the command a second time
+FAKE_SCRIPT = '''sleep 0.8
+case "$*" in
+    "status") echo "Connected to se-got-wg-001 in Gothenburg, Sweden";;
+    "relay get") echo "Current constraints: WireGuard location city got, se";;
+    "version") printf "Current version: 2020.4\\nIs supported: true\\nSuggested upgrade: none\\nLatest stable version: 2020.4\\n";;
+    "account get") printf "Mullvad account: 1234567890123456\\nAccount expires at: 2030-01-01 12:00:00\\n";;
+    "always-require-vpn get") echo "Network traffic will be blocked when the VPN is disconnected";;
+    "lan get") echo "Local network sharing setting: $(cat "$FAKE_MULLVAD_DIR/lan" 2>/dev/null || echo allow)";;
+    "lan set "*) echo "$3" > "$FAKE_MULLVAD_DIR/lan";;
+    "auto-connect get") echo "Autoconnect: off";;
+    *) echo "unknown command $*" >&2; exit 2;;
+esac
+'''
+
+START_SCREEN = ['status', 'relay get', 'always-require-vpn get', 'lan get', 'auto-connect get', 'version', 'account get']
+
+# two start screen renders, e.g. two keystrokes; the memo only lasts for one Script Filter run
+RENDERS = '''
+import mullvad
+for _ in range(2):
+    mullvad.memo.clear()
+    mullvad.probe_status()
+    print(mullvad.get_lan()[0])
+'''
+
+
+@pytest.fixture
+def env(fake_mullvad):
+    return fake_mullvad(FAKE_SCRIPT)
+
+
+@pytest.fixture
+def broker(env):
+    proc = subprocess.Popen([sys.executable, 'mullvad_broker.py'], cwd=SRC, env=env)
+    socket = os.path.join(env['TMPDIR'], 'mullvad-broker-{}.sock'.format(os.getuid()))
+    deadline = time.time() + 10
+    while not os.path.exists(socket):
+        assert time.time() < deadline and proc.poll() is None, 'broker did not start'
+        time.sleep(0.05)
+    yield proc
+    proc.terminate()
+    proc.wait()
+
+
+def render(env):
+    proc = subprocess.run([sys.executable, '-c', RENDERS], cwd=SRC, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=30)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.splitlines()
+
+
+def test_renders_run_each_command_once(env, broker):
+    assert render(env) == ['Local network sharing setting: allow'] * 2
+    assert Counter(invocations(env)) == Counter(START_SCREEN)
+
+
+def test_state_change_is_not_served_stale(env, broker):
+    render(env)
+    arg = subprocess.run([sys.executable, '-c', 'import mullvad; print(mullvad.cli_arg("lan set block"))'],
+                         cwd=SRC, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+    subprocess.run(arg, shell=True, env=env, check=True) # like Alfred runs the item's arg
+    assert render(env) == ['Local network sharing setting: block'] * 2
+    assert invocations(env).count('lan get') == 2
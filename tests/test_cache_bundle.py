@@ -0,0 +1,51 @@
+# python 3
+# encoding: utf-8
+
+import sys
+import subprocess
+
+import pytest
+
+from conftest import SRC
+from workflow import Workflow
+
+# holds the lock of a file until its stdin is closed; fcntl locks don't conflict within one process
+HOLD_LOCK = '''
+import sys
+from workflow.util import LockFile
+with LockFile(sys.argv[1]):
+    print('locked', flush=True)
+    sys.stdin.read()
+'''
+
+
+@pytest.fixture
+def wf(tmp_path, monkeypatch):
+    monkeypatch.chdir(SRC)
+    monkeypatch.setenv('alfred_workflow_bundleid', 'net.test.mullvad')
+    monkeypatch.setenv('alfred_workflow_cache', str(tmp_path / 'cache'))
+    monkeypatch.setenv('alfred_workflow_data', str(tmp_path / 'data'))
+    return Workflow()
+
+
+def test_set_saves_entries(wf):
+    wf.cache_bundle('bundle').set('failure', {'count': 1})
+    wf.cache_bundle('other').set('x', 1) # a second bundle doesn't clobber the first
+    assert Workflow().cache_bundle('bundle').get('failure', max_age=0) == {'count': 1}
+
+
+def test_set_with_the_bundle_locked(wf):
+    bundle = wf.cache_bundle('bundle')
+    bundle.set('kept', 1)
+    path = wf.cachefile('bundle.{}'.format(wf.cache_serializer))
+    # e.g. held by a revalidate job or the refresh job
+    with subprocess.Popen([sys.executable, '-c', HOLD_LOCK, path], cwd=SRC, text=True,
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE) as holder:
+        assert holder.stdout.readline() == 'locked\n'
+        bundle.set('failure', {'count': 1})
+        bundle.set('kept', None)
+        holder.stdin.close()
+    # only this process has the changes
+    assert bundle.get('failure', max_age=0) == {'count': 1}
+    assert bundle.get('kept', max_age=0) is None
+    assert Workflow().cache_bundle('bundle').get('kept', max_age=0) == 1
@@ -0,0 +1,63 @@
+# python 3
+# encoding: utf-8
+
+import os
+import sys
+import glob
+import subprocess
+
+import pytest
+
+from conftest import SRC, invocations
+
+PROCESSES = 6 # Script Filters Alfred launched in quick succession
+RELAY_LIST = '''Albania (al)
+\tTirana (tia) @ 41.32795°N, 19.81874°W
+\t\tal-tia-wg-001 (31.171.153.66, 2a04:27c0:0:3::a01f) - WireGuard, hosted by iRegister (rented)
+
+Sweden (se)
+\tMalmö (mma) @ 55.60587°N, 13.00073°W
+\t\tse-mma-wg-001 (193.138.218.220, 2a03:1b20:5:f011:31::a01f) - WireGuard, hosted by 31173 (owned)
+'''
+
+# answers slowly enough for all the processes to find the cache missing or stale
+FAKE_SCRIPT = '''sleep 1
+case "$*" in
+    "relay list") cat "$FAKE_MULLVAD_DIR/relays.txt";;
+    *) echo "unknown command $*" >&2; exit 2;;
+esac
+'''
+
+# what mullvad_refresh and the relay views do: read the relay index, regenerating it if needed
+SCRIPT_FILTER = 'import mullvad; print(mullvad.get_country_list())'
+
+
+@pytest.fixture
+def env(tmp_path, fake_mullvad):
+    (tmp_path / 'relays.txt').write_text(RELAY_LIST, encoding='utf-8')
+    return fake_mullvad(FAKE_SCRIPT)
+
+
+def run_script_filters(env):
+    procs = [subprocess.Popen([sys.executable, '-c', SCRIPT_FILTER], cwd=SRC, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for _ in range(PROCESSES)]
+    outputs = [proc.communicate(timeout=30) for proc in procs]
+    for proc, (out, err) in zip(procs, outputs):
+        assert proc.returncode == 0, err
+    return [out for out, _ in outputs]
+
+
+def test_missing_cache_is_generated_once(env):
+    outputs = run_script_filters(env)
+    assert invocations(env) == ['relay list']
+    assert set(outputs) == {"['Albania (al)', 'Sweden (se)']\n"}
+
+
+def test_expired_cache_is_regenerated_once(env):
+    run_script_filters(env)
+    for path in glob.glob(os.path.join(env['alfred_workflow_cache'], 'mullvad_relay_index.*')):
+        os.utime(path, (0, 0)) # older than any max_age
+    outputs = run_script_filters(env)
+    assert invocations(env) == ['relay list', 'relay list']
+    assert set(outputs) == {"['Albania (al)', 'Sweden (se)']\n"}
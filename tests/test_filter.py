@@ -0,0 +1,169 @@
+# python 3
+# encoding: utf-8
+
+import re
+import random
+
+import pytest
+
+from conftest import SRC
+from workflow import workflow, Workflow3
+from workflow.workflow import (Workflow, isascii, split_on_delimiters, INITIALS, MATCH_ALL, MATCH_ALLCHARS,
+                               MATCH_ATOM, MATCH_CAPITALS, MATCH_INITIALS, MATCH_INITIALS_CONTAIN,
+                               MATCH_INITIALS_STARTSWITH, MATCH_STARTSWITH, MATCH_SUBSTRING)
+
+#############################
+######## REFERENCE   ########
+#############################
+
+# Workflow.filter() and Workflow._filter_item() before the compiled matcher, the bounded heap and the search index
+
+def reference_item(value, query, match_on, fold_diacritics):
+    query = query.lower()
+    if not isascii(query):
+        fold_diacritics = False
+    if fold_diacritics:
+        value = workflow.fold_to_ascii(value)
+    if not set(query) <= set(value.lower()):
+        return (0, None)
+    if match_on & MATCH_STARTSWITH and value.lower().startswith(query):
+        return (100.0 - len(value) / len(query), MATCH_STARTSWITH)
+    if match_on & MATCH_CAPITALS:
+        initials = ''.join([c for c in value if c in INITIALS])
+        if initials.lower().startswith(query):
+            return (100.0 - len(initials) / len(query), MATCH_CAPITALS)
+    if match_on & MATCH_ATOM or match_on & MATCH_INITIALS_CONTAIN or match_on & MATCH_INITIALS_STARTSWITH:
+        atoms = [s.lower() for s in split_on_delimiters(value)]
+        initials = ''.join([s[0] for s in atoms if s])
+    if match_on & MATCH_ATOM:
+        if query in atoms:
+            return (100.0 - len(value) / len(query), MATCH_ATOM)
+    if match_on & MATCH_INITIALS_STARTSWITH and initials.startswith(query):
+        return (100.0 - len(initials) / len(query), MATCH_INITIALS_STARTSWITH)
+    elif match_on & MATCH_INITIALS_CONTAIN and query in initials:
+        return (95.0 - len(initials) / len(query), MATCH_INITIALS_CONTAIN)
+    if match_on & MATCH_SUBSTRING and query in value.lower():
+        return (90.0 - len(value) / len(query), MATCH_SUBSTRING)
+    if match_on & MATCH_ALLCHARS:
+        match = re.compile(''.join('.*?{0}'.format(re.escape(c)) for c in query), re.IGNORECASE).search(value)
+        if match:
+            return (100.0 / ((1 + match.start()) * (match.end() - match.start() + 1)), MATCH_ALLCHARS)
+    return (0, None)
+
+
+def reference_filter(query, items, include_score=False, min_score=0, max_results=0, match_on=MATCH_ALL,
+                     fold_diacritics=True):
+    if not query or not query.strip():
+        return items
+    query = query.strip()
+    results = []
+    for item in items:
+        skip = False
+        score = 0
+        value = item.strip()
+        if value == '':
+            continue
+        for word in [s.strip() for s in query.split(' ')]:
+            if word == '':
+                continue
+            s, rule = reference_item(value, word, match_on, fold_diacritics)
+            if not s:
+                skip = True
+            score += s
+        if skip:
+            continue
+        if score:
+            results.append(((100.0 / score, value.lower(), score), (item, score, rule)))
+    results.sort()
+    results = [t[1] for t in results]
+    if min_score:
+        results = [r for r in results if r[1] > min_score]
+    if max_results and len(results) > max_results:
+        results = results[:max_results]
+    if include_score:
+        return results
+    return [t[0] for t in results]
+
+
+#############################
+######## FIXTURES    ########
+#############################
+
+RULES = [MATCH_STARTSWITH, MATCH_CAPITALS, MATCH_ATOM, MATCH_INITIALS_STARTSWITH, MATCH_INITIALS_CONTAIN,
+         MATCH_INITIALS, MATCH_SUBSTRING, MATCH_ALLCHARS, MATCH_ATOM | MATCH_SUBSTRING, MATCH_ALL ^ MATCH_ALLCHARS,
+         MATCH_ALL] + random.Random(1).sample(range(1, MATCH_ALL), 8)
+
+# relay labels, and random strings mixing case, delimiters, digits, diacritics and non-Latin text
+ITEMS = ['Malmö (mma)', 'Zürich (zrh)', 'São Paulo (sao)', 'Gothenburg (got)', 'United Kingdom (gb)', 'Straße',
+         'se-got-wg-001', 'ΑΣ.Β', ' ', ''] + \
+        [''.join(random.Random(i).choice('abcdeéöüßZÜRICH- .xyS0Σσ') for _ in range(random.Random(-i).randint(0, 12)))
+         for i in range(400)]
+
+QUERIES = ['a', 'ab', 'z', 'zu', 'mal', 'ö', 'x s', ' e ', 'sao', 'ss', 'gb', 'uk', 'zr', 'é', 'sg0', 'σ', 'got wg', '  ']
+
+VARIANTS = [{}, {'min_score': 20}, {'max_results': 1}, {'max_results': 5, 'min_score': 20}]
+
+
+@pytest.fixture
+def wf(tmp_path, monkeypatch):
+    monkeypatch.chdir(SRC)
+    monkeypatch.setenv('alfred_workflow_bundleid', 'net.test.mullvad')
+    monkeypatch.setenv('alfred_workflow_cache', str(tmp_path / 'cache'))
+    monkeypatch.setenv('alfred_workflow_data', str(tmp_path / 'data'))
+    return Workflow()
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def candidates(request, monkeypatch):
+    """ SearchIndex finds candidates with numpy if it is installed, else in pure Python """
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        monkeypatch.setattr(workflow, '_numpy_module', workflow.UNSET)
+    else:
+        monkeypatch.setattr(workflow, '_numpy_module', None)
+    return request.param
+
+
+#############################
+######## TESTS       ########
+#############################
+
+@pytest.mark.parametrize('match_on', RULES)
+def test_search_index_ranks_like_reference(wf, candidates, match_on):
+    index = wf.search_keys(ITEMS)
+    wf.cache_data('keys', index) # the relay views read the keys the refresh job pickled
+    pickled = wf.cached_data('keys', max_age=0)
+    for query in QUERIES:
+        for fold in (True, False):
+            for variant in VARIANTS:
+                expected = reference_filter(query, ITEMS, include_score=True, match_on=match_on,
+                                            fold_diacritics=fold, **variant)
+                for keys in (None, index, pickled):
+                    assert wf.filter(query, ITEMS, include_score=True, match_on=match_on, fold_diacritics=fold,
+                                     keys=keys, **variant) == expected, (query, fold, variant, type(keys))
+
+
+@pytest.mark.parametrize('cls', [Workflow, Workflow3])
+def test_incremental_filter_ranks_like_reference(wf, candidates, monkeypatch, cls):
+    """ Typing replays, one Workflow per keystroke like one Script Filter run per keystroke """
+    monkeypatch.setenv('_WF_SESSION_ID', 'session') # Workflow3 keeps the state per session
+    index = wf.search_keys(ITEMS)
+    rng = random.Random(0)
+    for replay in range(60):
+        match_on = rng.choice(RULES)
+        fold = rng.random() < 0.8
+        variant = rng.choice(VARIANTS)
+        target = ''.join(rng.choice('sweabcdzürichσς .-Α') for _ in range(rng.randint(1, 8)))
+        query = ''
+        for _ in range(12): # mostly typing, sometimes deleting or adding an unexpected character
+            r = rng.random()
+            if r < 0.7 and len(query) < len(target):
+                query = target[:len(query) + 1]
+            elif r < 0.85:
+                query = query[:-1]
+            else:
+                query += rng.choice(' sΣa')
+            expected = reference_filter(query, ITEMS, include_score=True, match_on=match_on,
+                                        fold_diacritics=fold, **variant)
+            assert cls().filter(query, ITEMS, include_score=True, match_on=match_on, fold_diacritics=fold,
+                                keys=index, incremental='typing', **variant) == expected, (replay, query)
@@ -0,0 +1,61 @@
+# python 3
+# encoding: utf-8
+
+import unicodedata
+
+import pytest
+
+from workflow import workflow
+from workflow.workflow import ASCII_REPLACEMENTS, fold_to_ascii, isascii
+
+
+def reference_isascii(text):
+    """ isascii() before it used str.isascii() """
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def reference_fold(text):
+    """ fold_to_ascii() before the translate table and the memo """
+    if reference_isascii(text):
+        return text
+    text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+    return unicodedata.normalize('NFKD', text)
+
+
+@pytest.fixture(autouse=True)
+def cold_memo():
+    workflow._fold_to_ascii.cache_clear()
+    yield
+    workflow._fold_to_ascii.cache_clear()
+
+
+def test_every_replacement():
+    for char in ASCII_REPLACEMENTS:
+        for text in (char, 'x' + char + 'y', char * 3, char.lower() + char.upper()):
+            assert fold_to_ascii(text) == reference_fold(text), text
+
+
+def test_all_replacements_at_once():
+    text = ''.join(ASCII_REPLACEMENTS)
+    assert fold_to_ascii(text) == reference_fold(text)
+
+
+def test_memo_hits_fold_the_same():
+    labels = ['Malmö (mma)', 'Zürich (zrh)', 'São Paulo (sao)', 'Kraków (krk)', 'Reykjavík (rkv)']
+    first = [fold_to_ascii(label) for label in labels]
+    assert [fold_to_ascii(label) for label in labels] == first == [reference_fold(label) for label in labels]
+    assert workflow._fold_to_ascii.cache_info().hits == len(labels)
+
+
+def test_other_code_points():
+    # combining, compatibility and unmapped characters go through NFKD as before
+    for codePoint in range(0x3000):
+        char = chr(codePoint)
+        assert isascii(char) == reference_isascii(char), codePoint
+        assert fold_to_ascii(char) == reference_fold(char), codePoint
+    for text in ('ﬁ①Σ', 'áë', 'Ǆ ǅ ǆ', ''):
+        assert fold_to_ascii(text) == reference_fold(text), text
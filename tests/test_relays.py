@@ -0,0 +1,44 @@
+# python 3
+# encoding: utf-8
+
+import io
+
+import pytest
+
+import relays
+from workflow.workflow import SchemaMismatch
+
+RELAY_LIST = '''Albania (al)
+\tTirana (tia) @ 41.32795°N, 19.81874°W
+\t\tal-tia-wg-001 (31.171.153.66, 2a04:27c0:0:3::a01f) - WireGuard, hosted by iRegister (rented)
+
+Sweden (se)
+\tMalmö (mma) @ 55.60587°N, 13.00073°W
+\t\tse-mma-wg-001 (193.138.218.220, 2a03:1b20:5:f011:31::a01f) - WireGuard, hosted by 31173 (owned)
+'''
+
+
+@pytest.fixture
+def data():
+    buf = io.BytesIO()
+    relays.RelaySerializer.dump(relays.parse_relay_list(RELAY_LIST.splitlines()), buf)
+    return buf.getvalue()
+
+
+def test_round_trip(data):
+    index = relays.MappedRelayIndex(data)
+    assert index.labels() == ['Albania (al)', 'Sweden (se)']
+    assert index.city('se', 'mma').servers[0].hostname == 'se-mma-wg-001'
+
+
+def test_truncated_file_is_a_cache_miss(data):
+    for length in range(len(data)):
+        with pytest.raises(SchemaMismatch):
+            relays.MappedRelayIndex(data[:length])
+
+
+def test_empty_file_is_a_cache_miss(tmp_path):
+    path = tmp_path / 'relays.relays'
+    path.write_bytes(b'')
+    with open(path, 'rb') as fp, pytest.raises(SchemaMismatch):
+        relays.RelaySerializer.load(fp)
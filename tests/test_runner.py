@@ -0,0 +1,52 @@
+# python 3
+# encoding: utf-8
+
+import time
+
+import pytest
+
+import mullvad_runner
+
+FAKE_SCRIPT = '''case "$*" in
+    "relay list") echo "Albania (al)"; echo "Error: Failed to connect to the daemon" >&2; exit 1;;
+    "noisy") head -c 200000 /dev/zero | tr '\\0' x >&2; echo done;;
+    "status listen") echo "Connected"; exec sleep 10;;
+esac
+'''
+
+
+@pytest.fixture
+def runner(fake_mullvad, monkeypatch):
+    env = fake_mullvad(FAKE_SCRIPT)
+    monkeypatch.setenv('FAKE_MULLVAD_LOG', env['FAKE_MULLVAD_LOG']) # the runner passes on this process's environment
+    return mullvad_runner.Runner(binary=env['mullvad_bin'])
+
+
+def consume(stream):
+    lines = []
+    while True:
+        try:
+            lines.append(next(stream))
+        except StopIteration as end:
+            return lines, end.value
+
+
+def test_lines_report_stderr(runner):
+    lines, (returncode, stderr) = consume(runner.lines(['mullvad', 'relay', 'list']))
+    assert lines == ['Albania (al)']
+    assert (returncode, stderr) == (1, 'Error: Failed to connect to the daemon\n')
+
+
+def test_lines_with_more_stderr_than_a_pipe_holds(runner):
+    lines, (returncode, stderr) = consume(runner.lines(['mullvad', 'noisy']))
+    assert lines == ['done']
+    assert (returncode, len(stderr)) == (0, 200000)
+
+
+def test_lines_are_killed_at_the_deadline(runner):
+    start = time.time()
+    lines, (returncode, stderr) = consume(runner.lines(['mullvad', 'status', 'listen'], timeout=0.5))
+    assert time.time() - start < 5
+    assert lines == ['Connected']
+    assert returncode == mullvad_runner.TIMEOUT_EXIT
+    assert 'did not answer within 0.5s' in stderr
@@ -0,0 +1,52 @@
+# python 3
+# encoding: utf-8
+
+import sys
+import subprocess
+
+import pytest
+
+from conftest import SRC, invocations
+
+import mullvad
+
+SERVERS = 120 # more than the server view lists
+
+RELAY_LIST = 'Sweden (se)\n\tMalmö (mma) @ 55.60587°N, 13.00073°W\n' + ''.join(
+    '\t\tse-mma-wg-{0:03} (193.138.218.{0}, 2a03:1b20:5:f011:31::{0}) - WireGuard, hosted by 31173 (owned)\n'.format(i)
+    for i in range(1, SERVERS + 1))
+
+FAKE_SCRIPT = '''case "$*" in
+    "relay list") cat "$FAKE_MULLVAD_DIR/relays.txt";;
+    *) echo "unknown command $*" >&2; exit 2;;
+esac
+'''
+
+# the server view of the Script Filter, printing the titles of its items
+SCRIPT_FILTER = 'import sys, mullvad; mullvad.list_relay_servers(mullvad.wf, sys.argv[1]); ' \
+                'print("\\n".join(item.title for item in mullvad.wf._items))'
+
+
+@pytest.fixture
+def env(tmp_path, fake_mullvad):
+    (tmp_path / 'relays.txt').write_text(RELAY_LIST, encoding='utf-8')
+    return fake_mullvad(FAKE_SCRIPT)
+
+
+def server_view(env, query):
+    proc = subprocess.run([sys.executable, '-c', SCRIPT_FILTER, query], cwd=SRC, env=env,
+                          capture_output=True, text=True, timeout=30)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.splitlines()
+
+
+@pytest.mark.parametrize('query', ['server', 'server ', 'server  '])
+def test_no_fragment_prompts(env, query):
+    assert server_view(env, query) == ['Type a hostname, IP or protocol']
+    assert invocations(env) == [] # the server list isn't even loaded
+
+
+def test_results_are_capped(env):
+    titles = server_view(env, 'server se-mma')
+    assert len(titles) == mullvad.SERVER_RESULTS
+    assert server_view(env, 'server se-mma-wg-117') == ['se-mma-wg-117']
@@ -0,0 +1,131 @@
+# python 3
+# encoding: utf-8
+
+import os
+import sys
+import time
+import signal
+import subprocess
+
+import pytest
+
+from conftest import SRC, invocations
+
+CONNECTED = 'Connected to se-got-wg-001 in Gothenburg, Sweden'
+
+# a streaming CLI: `status listen` reports two transitions and stays open.
+# A `down` file makes every command fail like a stopped daemon, a `nolisten` file makes the stream end right away
+FAKE_SCRIPT = '''if [ -e "$FAKE_MULLVAD_DIR/down" ]; then
+    echo "Error: Failed to connect to the daemon" >&2; exit 1
+fi
+case "$*" in
+    "status") echo "Disconnected";;
+    "status listen")
+        [ -e "$FAKE_MULLVAD_DIR/nolisten" ] && exit 0
+        echo "Connecting to se-got-wg-001"; sleep 0.3
+        echo "New tunnel state: ''' + CONNECTED + '''"
+        exec sleep 10;;
+    *) echo "unknown command $*" >&2; exit 2;;
+esac
+'''
+
+# one keystroke's worth of the Script Filter: launch the watcher like main() does
+START = 'import mullvad; print(mullvad.start_watcher())'
+# what the start screen reads: the watcher's state, the raw cache, and the connection status, polled if unwatched
+READ = '''
+import mullvad, mullvad_watcher
+print(repr((mullvad_watcher.watched_status(mullvad.wf),
+            mullvad.wf.cached_data(mullvad_watcher.WATCHER_CACHE, max_age=0),
+            mullvad.get_connection())))
+'''
+
+
+@pytest.fixture
+def env(fake_mullvad):
+    return fake_mullvad(FAKE_SCRIPT)
+
+
+def python(env, code):
+    proc = subprocess.run([sys.executable, '-c', code], cwd=SRC, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=30)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.strip()
+
+
+def read(env):
+    watched, cached, connection = eval(python(env, READ))
+    return watched, cached and cached['status'], connection
+
+
+def job_pid(env):
+    """ PID of the watcher's background runner, the watcher runs in its process group """
+    try:
+        with open(os.path.join(env['alfred_workflow_cache'], 'mullvad_watcher.pid'), 'rb') as fp:
+            return int.from_bytes(fp.read(), sys.byteorder)
+    except FileNotFoundError:
+        return None
+
+
+def kill(env, sig):
+    """ Signal the watcher and its background runner, but not the stream, which runs in its own session """
+    os.killpg(os.getpgid(job_pid(env)), sig)
+
+
+def running(env):
+    pid = job_pid(env)
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.1)
+
+
+@pytest.fixture
+def watcher(env):
+    assert python(env, START) == 'True'
+    wait_for(lambda: read(env)[0] == [CONNECTED])
+    yield
+    if running(env):
+        kill(env, signal.SIGKILL)
+
+
+def test_transitions_land_in_cache(env, watcher):
+    assert read(env) == ([CONNECTED], [CONNECTED], [CONNECTED])
+    # the start probe and the stream, reading the connection status did not fork
+    assert invocations(env) == ['status', 'status listen']
+
+
+def test_sigterm_clears_cache(env, watcher):
+    kill(env, signal.SIGTERM)
+    wait_for(lambda: read(env)[1] is None)
+    assert read(env) == (None, None, ['Disconnected']) # polled
+
+
+def test_polls_after_sigkill(env, watcher):
+    kill(env, signal.SIGKILL)
+    wait_for(lambda: not running(env))
+    # the killed watcher could not clear its state, readers must not trust it
+    assert read(env) == (None, [CONNECTED], ['Disconnected'])
+    assert invocations(env).count('status') == 2
+
+
+@pytest.mark.parametrize('failure', ['down', 'nolisten'])
+def test_failing_watcher_backs_off(env, tmp_path, failure):
+    (tmp_path / failure).touch()
+    assert python(env, START) == 'True'
+    time.sleep(0.5)
+    wait_for(lambda: not running(env))
+    first = invocations(env)
+    for _ in range(3): # keystrokes within the backoff
+        assert python(env, START) == 'False'
+    assert invocations(env) == first
+    assert first == (['status'] if failure == 'down' else ['status', 'status listen'])